@@ -0,0 +1,7 @@
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent))
+from vgamepadnet import bench
+
+bench.main()
@@ -0,0 +1,9 @@
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent))
+from vgamepadnet import loadtest
+
+# 客户端在子进程里运行，Windows 上子进程会重新导入这个文件
+if __name__ == "__main__":
+    loadtest.main()
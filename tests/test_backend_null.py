@@ -0,0 +1,177 @@
+import asyncio
+from typing import List, Tuple
+
+import pytest
+from aiohttp import WSMessage, WSMsgType
+
+from vgamepadnet import protocol, trace
+from vgamepadnet.backend import Backend, Gamepad, GamepadMode
+from vgamepadnet.backend_null import NullBackend, NullGamepad
+from vgamepadnet.driver import Driver
+from vgamepadnet.pool import GamepadPool
+from vgamepadnet.session import SEQ_STALE_MS, Session
+from vgamepadnet.trace import tracer
+
+
+def make_session(backend: NullBackend) -> Session:
+    session = Session(1, None, Driver(), GamepadPool(backend))  # type: ignore
+    session.set_gamepad(backend.create(GamepadMode.XBOX), GamepadMode.XBOX)
+    return session
+
+
+def test_abstract_interfaces() -> None:
+    class Partial(Gamepad):
+        def update(self) -> None:
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()  # type: ignore
+    with pytest.raises(TypeError):
+        Backend()  # type: ignore
+
+
+def test_session_reports() -> None:
+    async def run() -> List[NullGamepad]:
+        backend = NullBackend()
+        session = make_session(backend)
+        session.input_states([("A", 1), ("LSx", 0.5), ("LSy", -0.25), ("RT", 0.75)])
+        session.input_states([("A", 0), ("up", 1)])
+        return backend.gamepads
+
+    (pad,) = asyncio.run(run())
+    assert pad.update_count == 2
+    first, second = pad.reports
+    a = 1 << protocol.BUTTON_FIELDS.index("A")
+    up = 1 << protocol.BUTTON_FIELDS.index("up")
+    assert first.buttons == a
+    assert (first.left_x, first.left_y) == (0.5, -0.25)
+    assert first.right_trigger == 0.75
+    assert second.buttons == up
+    assert second.left_x == 0.5
+
+
+def test_trigger_tap_survives_batching() -> None:
+    async def run() -> NullGamepad:
+        backend = NullBackend()
+        session = make_session(backend)
+        for value in (1.0, 0.0):
+            session.input_states([("LT", value)])
+        return backend.gamepads[0]
+
+    pad = asyncio.run(run())
+    assert [report.left_trigger for report in pad.reports] == [1.0, 0.0]
+
+
+def test_feedback_reaches_state_out() -> None:
+    async def run() -> Session:
+        backend = NullBackend()
+        session = make_session(backend)
+        session.disconnected = True  # 没有连接，只检查记录下来的值
+        backend.gamepads[0].inject(255, 0, 3)
+        await asyncio.sleep(0)
+        return session
+
+    session = asyncio.run(run())
+    assert session.state_out["large_motor"] == 1.0
+    assert session.state_out["led_number"] == 3
+
+
+def test_trace_applies_state_frames_only() -> None:
+    async def run() -> List[int]:
+        session = make_session(NullBackend())
+        session.disconnected = True  # ping 不需要回复
+        tracer.enable(100)
+        try:
+            batch = ["set A 1", "ping", "set LSx 0.5", "set LSx 0.25"]
+            await session.handle_batch(
+                [WSMessage(WSMsgType.TEXT, data, None) for data in batch]
+            )
+            events = [event for event in tracer.events if event is not None]
+        finally:
+            tracer.enable(0)
+        return [event[3] for event in events if event[1] == trace.APPLY]
+
+    # 第 2 条是 ping，合并的两帧都要记录
+    assert sorted(asyncio.run(run())) == [1, 3, 4]
+
+
+def test_mode_switch_drops_pending_fields() -> None:
+    async def run() -> NullGamepad:
+        backend = NullBackend()
+        pool = GamepadPool(backend)
+        session = Session(1, None, Driver(), pool, report_rate=60)  # type: ignore
+        session.set_gamepad(backend.create(GamepadMode.XBOX), GamepadMode.XBOX)
+        session.input_states([("LSx", 0.25)])  # 离开 0，立即发送
+        session.input_states([("LSx", 0.5)])  # 等待定时发送
+        await session.handle_message("mode ds4")
+        assert not session.pending
+        session.flush_pending()
+        await pool.close()
+        return backend.gamepads[-1]
+
+    pad = asyncio.run(run())
+    assert pad.mode == GamepadMode.DS4
+    assert [report.left_x for report in pad.reports] == [0.0]
+
+
+def sequenced(seq: int, time_ms: float, fields: str) -> List[str]:
+    return f"set seq {seq} time {time_ms:.0f} {fields}".split(" ")
+
+
+def test_batch_merges_frames_but_keeps_edges() -> None:
+    async def run() -> Tuple[Session, NullGamepad]:
+        backend = NullBackend()
+        session = make_session(backend)
+        batch = ["set LSx 0.1", "set LSx 0.2 A 1", "set LSx 0.3 A 0"]
+        await session.handle_batch(
+            [WSMessage(WSMsgType.TEXT, data, None) for data in batch]
+        )
+        return session, backend.gamepads[0]
+
+    session, pad = asyncio.run(run())
+    a = 1 << protocol.BUTTON_FIELDS.index("A")
+    # A 松开前先发送按下的那份报告，摇杆只需要最终位置
+    assert [report.buttons for report in pad.reports] == [a, 0]
+    assert pad.reports[-1].left_x == 0.3
+    assert session.frames_merged == 2
+
+
+def test_binary_frames() -> None:
+    async def run() -> Session:
+        session = make_session(NullBackend())
+        data = protocol.STATE_FRAME.pack(protocol.FRAME_STATE, 0, 0, 255, 0, 0, 0, 0)
+        await session.handle_batch([WSMessage(WSMsgType.BINARY, data, None)])
+        for bad in (b"", bytes([99])):
+            with pytest.raises(ValueError):
+                session.parse_binary(bad)
+        return session
+
+    assert asyncio.run(run()).state["RT"] == 1.0
+
+
+def test_stale_frames_hold_sticks_but_keep_buttons() -> None:
+    async def run() -> Session:
+        session = make_session(NullBackend())
+        now_ms = session.main_loop.time() * 1000
+        session.input_states(session.parse_set(sequenced(5, now_ms, "LSx 0.5 RSx 0.5")))
+        # 序号倒退：按键和离开 0 的扳机立即应用，摇杆暂缓
+        fields = session.parse_set(sequenced(4, now_ms, "LSx 0.1 A 1 RT 1"))
+        assert fields == [("A", 1.0), ("RT", 1.0)]
+        assert session.seq_held == {"LSx": 0.1}
+        # 比最快的帧晚到超过 SEQ_STALE_MS 也算过期
+        fields = session.parse_set(
+            sequenced(6, now_ms - SEQ_STALE_MS - 50, "LSx 0.2 RSx 0.3")
+        )
+        assert fields == []
+        assert session.seq_held == {"LSx": 0.2, "RSx": 0.3}
+        assert session.seq_stale == 2
+        # 之后的新帧更新了 LSx，暂缓的值只剩 RSx
+        fields = session.parse_set(sequenced(7, now_ms, "LSx 0.7"))
+        session.input_states(fields)
+        session.flush_held()
+        return session
+
+    session = asyncio.run(run())
+    assert session.state["LSx"] == 0.7
+    assert session.state["RSx"] == 0.3
+    assert session.seq_held_timer is None
@@ -0,0 +1,38 @@
+import asyncio
+
+from vgamepadnet.backend import GamepadMode
+from vgamepadnet.backend_null import NullBackend, NullGamepad
+from vgamepadnet.pool import GamepadPool
+
+
+def test_release_closes_pad_when_pool_is_full() -> None:
+    async def run() -> NullGamepad:
+        pool = GamepadPool(NullBackend())
+        gamepad = await pool.acquire(GamepadMode.XBOX)
+        pool.release(gamepad, GamepadMode.XBOX)
+        await pool.close()
+        assert isinstance(gamepad, NullGamepad)
+        return gamepad
+
+    assert asyncio.run(run()).closed
+
+
+def test_release_keeps_pad_for_reuse() -> None:
+    async def run() -> None:
+        backend = NullBackend()
+        pool = GamepadPool(backend, size=1)
+        # 直接取出，不触发后台补充
+        first = await pool.call(lambda: pool.take(GamepadMode.DS4))
+        first.register_notification(lambda large, small, led: None)
+        first.left_trigger(1.0)
+        pool.release(first, GamepadMode.DS4)
+        await pool.call(lambda: None)
+        assert isinstance(first, NullGamepad)
+        assert not first.closed
+        assert first.callback is None
+        assert first.reports[-1].left_trigger == 0.0
+        assert first in pool.idle[GamepadMode.DS4]
+        await pool.close()
+        assert all(gamepad.closed for gamepad in backend.gamepads)
+
+    asyncio.run(run())
@@ -0,0 +1,43 @@
+import struct
+
+import pytest
+
+from vgamepadnet import protocol
+
+
+def test_decode_state() -> None:
+    a = 1 << protocol.BUTTON_FIELDS.index("A")
+    up = 1 << protocol.BUTTON_FIELDS.index("up")
+    data = protocol.STATE_FRAME.pack(
+        protocol.FRAME_STATE,
+        a | up,
+        protocol.TRIGGER_MAX,
+        0,
+        protocol.STICK_MAX,
+        -protocol.STICK_MAX,
+        0,
+        protocol.STICK_MAX // 2,
+    )
+    fields = dict(protocol.decode_state(data))
+    assert list(fields) == protocol.FIELDS
+    assert fields["A"] == 1 and fields["up"] == 1 and fields["B"] == 0
+    assert (fields["LT"], fields["RT"]) == (1.0, 0.0)
+    assert (fields["LSx"], fields["LSy"], fields["RSx"]) == (1.0, -1.0, 0.0)
+    assert fields["RSy"] == pytest.approx(0.5, abs=1e-4)
+
+
+def test_decode_state_seq() -> None:
+    y = 1 << protocol.BUTTON_FIELDS.index("Y")
+    data = protocol.STATE_SEQ_FRAME.pack(
+        protocol.FRAME_STATE_SEQ, protocol.SEQ_MOD - 1, 123456, y, 0, 51, 0, 0, 0, 0
+    )
+    seq, time_ms, fields = protocol.decode_state_seq(data)
+    assert (seq, time_ms) == (protocol.SEQ_MOD - 1, 123456)
+    values = dict(fields)
+    assert values["Y"] == 1
+    assert values["RT"] == pytest.approx(0.2)
+
+
+def test_decode_short_frame() -> None:
+    with pytest.raises(struct.error):
+        protocol.decode_state(bytes([protocol.FRAME_STATE, 0, 0]))
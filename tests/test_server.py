@@ -0,0 +1,18 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import make_mocked_request
+
+from vgamepadnet.backend_null import NullBackend
+from vgamepadnet.server import Server
+
+
+@pytest.mark.parametrize("seconds", ["inf", "nan", "-1", "0", "301", "abc"])
+def test_profile_rejects_bad_seconds(seconds: str) -> None:
+    async def run() -> int:
+        server = Server(backend=NullBackend())
+        request = make_mocked_request("GET", f"/x/profile?seconds={seconds}")
+        response = await server.profile_handler(request)
+        return response.status
+
+    assert asyncio.run(run()) == 400
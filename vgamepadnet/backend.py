@@ -0,0 +1,96 @@
+from abc import ABC, abstractmethod
+from enum import Enum
+from typing import Callable
+
+# 手柄反馈：大马达, 小马达 (0-255), LED 编号
+NotificationCallback = Callable[[int, int, int], None]
+
+
+class GamepadMode(Enum):
+    NONE = 0
+    XBOX = 1
+    DS4 = 2
+
+
+class Gamepad(ABC):
+    """
+    一个虚拟手柄。在手柄池的线程里插入、恢复和移除，借给会话期间只在驱动线程里调用
+    """
+
+    @abstractmethod
+    def button_handler(self, name: str) -> Callable[[float], None]:
+        """
+        返回修改按键 name 的函数，参数为 0 表示松开，其他表示按下。
+        name 是 protocol.BUTTON_FIELDS 里的名字
+        """
+
+    @abstractmethod
+    def left_trigger(self, value: float) -> None: ...
+
+    @abstractmethod
+    def right_trigger(self, value: float) -> None: ...
+
+    @abstractmethod
+    def left_stick(self, x: float, y: float) -> None:
+        """
+        x 向右为正，y 向上为正，范围 -1 到 1
+        """
+
+    @abstractmethod
+    def right_stick(self, x: float, y: float) -> None: ...
+
+    @abstractmethod
+    def update(self) -> None:
+        """
+        把修改后的报告发送出去
+        """
+
+    @abstractmethod
+    def reset(self) -> None:
+        """
+        清空报告(不发送)
+        """
+
+    @abstractmethod
+    def register_notification(self, callback: NotificationCallback) -> None:
+        """
+        注册震动和 LED 的反馈，callback 可能在其他线程里调用
+        """
+
+    @abstractmethod
+    def unregister_notification(self) -> None: ...
+
+    @abstractmethod
+    def close(self) -> None:
+        """
+        立即移除设备，之后不能再使用。不能依赖垃圾回收，反馈回调可能形成循环引用
+        """
+
+
+class Backend(ABC):
+    """
+    创建虚拟手柄的后端
+    """
+
+    @abstractmethod
+    def create(self, mode: GamepadMode) -> Gamepad:
+        """
+        插入一个新的虚拟手柄，在手柄池的线程里调用
+        """
+
+
+def load_backend(name: str) -> Backend:
+    """
+    按名字加载后端，"vigem" 使用 ViGEmBus 驱动(只能在 Windows 上使用)，
+    "null" 只在内存里记录报告，用于测试
+    """
+    if name == "vigem":
+        from .backend_vigem import ViGEmBackend
+
+        return ViGEmBackend()
+    elif name == "null":
+        from .backend_null import NullBackend
+
+        return NullBackend()
+    else:
+        raise ValueError(f"Unknown backend {name!r}")
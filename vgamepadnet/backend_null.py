@@ -0,0 +1,123 @@
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, List, Optional
+
+from . import protocol
+from .backend import Backend, Gamepad, GamepadMode, NotificationCallback
+
+REPORTS_KEPT = 10000  # 每个手柄保留最近的报告数
+
+
+@dataclass
+class Report:
+    time: float  # time.perf_counter() 的值
+    buttons: int  # 按 protocol.BUTTON_FIELDS 顺序的位掩码
+    left_trigger: float
+    right_trigger: float
+    left_x: float
+    left_y: float
+    right_x: float
+    right_y: float
+
+
+class NullGamepad(Gamepad):
+    """
+    不连接任何驱动，只在内存里记录发送的报告
+    """
+
+    def __init__(self, mode: GamepadMode, keep: int = REPORTS_KEPT) -> None:
+        self.mode = mode
+        self.buttons = 0
+        self.left_trigger_value = 0.0
+        self.right_trigger_value = 0.0
+        self.left_x = 0.0
+        self.left_y = 0.0
+        self.right_x = 0.0
+        self.right_y = 0.0
+        self.reports: Deque[Report] = deque(maxlen=keep)
+        self.update_count = 0
+        self.callback: Optional[NotificationCallback] = None
+        self.closed = False
+
+    def button_handler(self, name: str) -> Callable[[float], None]:
+        bit = 1 << protocol.BUTTON_FIELDS.index(name)
+
+        def handler(value: float) -> None:
+            if value == 0:
+                self.buttons &= ~bit
+            else:
+                self.buttons |= bit
+
+        return handler
+
+    def left_trigger(self, value: float) -> None:
+        self.left_trigger_value = value
+
+    def right_trigger(self, value: float) -> None:
+        self.right_trigger_value = value
+
+    def left_stick(self, x: float, y: float) -> None:
+        self.left_x = x
+        self.left_y = y
+
+    def right_stick(self, x: float, y: float) -> None:
+        self.right_x = x
+        self.right_y = y
+
+    def update(self) -> None:
+        self.update_count += 1
+        self.reports.append(
+            Report(
+                time.perf_counter(),
+                self.buttons,
+                self.left_trigger_value,
+                self.right_trigger_value,
+                self.left_x,
+                self.left_y,
+                self.right_x,
+                self.right_y,
+            )
+        )
+
+    def reset(self) -> None:
+        self.buttons = 0
+        self.left_trigger_value = 0.0
+        self.right_trigger_value = 0.0
+        self.left_x = 0.0
+        self.left_y = 0.0
+        self.right_x = 0.0
+        self.right_y = 0.0
+
+    def register_notification(self, callback: NotificationCallback) -> None:
+        self.callback = callback
+
+    def unregister_notification(self) -> None:
+        self.callback = None
+
+    def close(self) -> None:
+        self.callback = None
+        self.closed = True
+
+    def inject(self, large_motor: int, small_motor: int, led_number: int) -> None:
+        """
+        模拟游戏发来的震动和 LED 反馈
+        """
+        callback = self.callback
+        if callback is not None:
+            callback(large_motor, small_motor, led_number)
+
+
+class NullBackend(Backend):
+    """
+    用于测试的后端，创建的手柄都记录在 gamepads 里
+    """
+
+    def __init__(self, keep: int = REPORTS_KEPT) -> None:
+        self.keep = keep
+        self.gamepads: List[NullGamepad] = []
+
+    def create(self, mode: GamepadMode) -> Gamepad:
+        gamepad = NullGamepad(mode, self.keep)
+        self.gamepads.append(gamepad)
+        return gamepad
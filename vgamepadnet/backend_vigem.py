@@ -0,0 +1,188 @@
+from typing import Any, Callable, Dict, Literal, Optional, Union
+
+import vgamepad  # type: ignore
+
+from .backend import Backend, Gamepad, GamepadMode, NotificationCallback
+
+button_map_xbox: Dict[str, vgamepad.XUSB_BUTTON] = {
+    "up": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_UP,
+    "down": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_DOWN,
+    "left": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_LEFT,
+    "right": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_RIGHT,
+    "start": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_START,
+    "back": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_BACK,
+    "LS": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_LEFT_THUMB,
+    "RS": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_RIGHT_THUMB,
+    "LB": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_LEFT_SHOULDER,
+    "RB": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_RIGHT_SHOULDER,
+    "guide": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_GUIDE,
+    "A": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_A,
+    "B": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_B,
+    "X": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_X,
+    "Y": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_Y,
+}
+
+
+button_map_ds4: Dict[
+    str, Union[vgamepad.DS4_BUTTONS, vgamepad.DS4_SPECIAL_BUTTONS, Literal["DPAD"]]
+] = {
+    "up": "DPAD",
+    "down": "DPAD",
+    "left": "DPAD",
+    "right": "DPAD",
+    "start": vgamepad.DS4_BUTTONS.DS4_BUTTON_OPTIONS,
+    "back": vgamepad.DS4_BUTTONS.DS4_BUTTON_SHARE,
+    "LS": vgamepad.DS4_BUTTONS.DS4_BUTTON_THUMB_LEFT,
+    "RS": vgamepad.DS4_BUTTONS.DS4_BUTTON_THUMB_RIGHT,
+    "LB": vgamepad.DS4_BUTTONS.DS4_BUTTON_SHOULDER_LEFT,
+    "RB": vgamepad.DS4_BUTTONS.DS4_BUTTON_SHOULDER_RIGHT,
+    "guide": vgamepad.DS4_SPECIAL_BUTTONS.DS4_SPECIAL_BUTTON_PS,
+    "A": vgamepad.DS4_BUTTONS.DS4_BUTTON_CROSS,
+    "B": vgamepad.DS4_BUTTONS.DS4_BUTTON_CIRCLE,
+    "X": vgamepad.DS4_BUTTONS.DS4_BUTTON_SQUARE,
+    "Y": vgamepad.DS4_BUTTONS.DS4_BUTTON_TRIANGLE,
+}
+
+direction_map_ds4 = {
+    (0, -1): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_NORTH,
+    (1, -1): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_NORTHEAST,
+    (1, 0): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_EAST,
+    (1, 1): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_SOUTHEAST,
+    (0, 1): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_SOUTH,
+    (-1, 1): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_SOUTHWEST,
+    (-1, 0): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_WEST,
+    (-1, -1): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_NORTHWEST,
+    (0, 0): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_NONE,
+}
+
+
+dpad_bit_ds4 = {"up": 1, "down": 2, "left": 4, "right": 8}
+
+
+def dpad_direction(bits: int) -> vgamepad.DS4_DPAD_DIRECTIONS:
+    dpad_x = 0
+    if bits & dpad_bit_ds4["left"]:
+        dpad_x -= 1
+    if bits & dpad_bit_ds4["right"]:
+        dpad_x += 1
+    dpad_y = 0
+    if bits & dpad_bit_ds4["up"]:
+        dpad_y -= 1
+    if bits & dpad_bit_ds4["down"]:
+        dpad_y += 1
+    return direction_map_ds4[(dpad_x, dpad_y)]
+
+
+# 方向键按下状态(位掩码) -> DS4 方向
+dpad_table_ds4 = [dpad_direction(bits) for bits in range(16)]
+
+
+class ViGEmGamepad(Gamepad):
+    """
+    通过 ViGEmBus 驱动插入的虚拟手柄
+    """
+
+    def __init__(self, mode: GamepadMode) -> None:
+        self.mode = mode
+        self.gamepad: Union[vgamepad.VX360Gamepad, vgamepad.VDS4Gamepad]
+        if mode == GamepadMode.XBOX:
+            self.gamepad = vgamepad.VX360Gamepad()
+            self.stick_y_sign = 1
+        elif mode == GamepadMode.DS4:
+            self.gamepad = vgamepad.VDS4Gamepad()
+            self.stick_y_sign = -1  # DS4 的 Y 轴方向和 Xbox 相反
+        else:
+            raise ValueError(f"Wrong mode {mode!r}")
+        self.dpad_bits = 0  # DS4 方向键，见 dpad_bit_ds4
+        self.callback: Optional[NotificationCallback] = None
+
+    def button_handler(self, name: str) -> Callable[[float], None]:
+        gamepad = self.gamepad
+
+        def button_handler(
+            press: Callable[[Any], None],
+            release: Callable[[Any], None],
+            button: Any,
+        ) -> Callable[[float], None]:
+            def handler(value: float) -> None:
+                if value == 0:
+                    release(button)
+                else:
+                    press(button)
+
+            return handler
+
+        if self.mode == GamepadMode.XBOX:
+            return button_handler(
+                gamepad.press_button, gamepad.release_button, button_map_xbox[name]
+            )
+        button_ds4 = button_map_ds4[name]
+        if button_ds4 == "DPAD":
+            bit = dpad_bit_ds4[name]
+            directional_pad = gamepad.directional_pad
+
+            def dpad_handler(value: float) -> None:
+                if value == 0:
+                    self.dpad_bits &= ~bit
+                else:
+                    self.dpad_bits |= bit
+                directional_pad(dpad_table_ds4[self.dpad_bits])
+
+            return dpad_handler
+        elif isinstance(button_ds4, vgamepad.DS4_SPECIAL_BUTTONS):
+            return button_handler(
+                gamepad.press_special_button,
+                gamepad.release_special_button,
+                button_ds4,
+            )
+        else:
+            return button_handler(
+                gamepad.press_button, gamepad.release_button, button_ds4
+            )
+
+    def left_trigger(self, value: float) -> None:
+        self.gamepad.left_trigger_float(value)
+
+    def right_trigger(self, value: float) -> None:
+        self.gamepad.right_trigger_float(value)
+
+    def left_stick(self, x: float, y: float) -> None:
+        self.gamepad.left_joystick_float(x, self.stick_y_sign * y)
+
+    def right_stick(self, x: float, y: float) -> None:
+        self.gamepad.right_joystick_float(x, self.stick_y_sign * y)
+
+    def update(self) -> None:
+        self.gamepad.update()
+
+    def reset(self) -> None:
+        self.gamepad.reset()
+        self.dpad_bits = 0
+
+    def register_notification(self, callback: NotificationCallback) -> None:
+        self.callback = callback
+        self.gamepad.register_notification(self.handle_notification)
+
+    def unregister_notification(self) -> None:
+        self.gamepad.unregister_notification()
+        self.callback = None
+
+    def close(self) -> None:
+        self.unregister_notification()
+        # vgamepad 注销时不会清除 cmp_func，它引用的 handle_notification 和
+        # self.gamepad 形成循环，要手动断开，VGamepad.__del__ 才会马上移除设备
+        self.gamepad.cmp_func = None
+        del self.gamepad
+
+    def handle_notification(  # type: ignore
+        self, client, target, large_motor, small_motor, led_number, user_data
+    ):
+        # vgamepad 会检查参数名，不能改
+        callback = self.callback
+        if callback is not None:
+            callback(large_motor, small_motor, led_number)
+
+
+class ViGEmBackend(Backend):
+    def create(self, mode: GamepadMode) -> Gamepad:
+        return ViGEmGamepad(mode)
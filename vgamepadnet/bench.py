@@ -0,0 +1,190 @@
+import asyncio
+import time
+from functools import partial
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from .backend import GamepadMode
+from .backend_null import NullBackend
+from .driver import Driver
+from .pool import GamepadPool
+from .session import Session, field_id
+
+ROUNDS = 200000
+DRIVER_ROUNDS = 20000  # 测量驱动线程开销时使用的字段数
+
+# 对照组使用的按键表，结构和 backend_vigem 的相同，用字符串代替 vgamepad 的常量
+legacy_button_map_xbox = {
+    name: f"XUSB_{name}"
+    for name in "up down left right start back LS RS LB RB guide A B X Y".split()
+}
+legacy_button_map_ds4 = {
+    **{name: "DPAD" for name in ("up", "down", "left", "right")},
+    **{name: f"DS4_{name}" for name in "start back LS RS LB RB A B X Y".split()},
+    "guide": "DS4_SPECIAL_PS",
+}
+legacy_direction_map_ds4 = {
+    (x, y): f"DPAD_{x}_{y}" for x in (-1, 0, 1) for y in (-1, 0, 1)
+}
+
+
+class LegacyGamepad:
+    """
+    什么都不做的 vgamepad 手柄，对照组直接调用它的方法
+    """
+
+    def __getattr__(self, name: str) -> Callable[..., None]:
+        def method(*args: Any) -> None:
+            pass
+
+        setattr(self, name, method)
+        return method
+
+
+def legacy_apply_state(
+    state: Dict[str, float],
+    gamepad: Any,
+    mode: GamepadMode,
+    name: str,
+    value: float,
+) -> bool:
+    """
+    改用分派表之前的 apply_state：每个字段按模式和名字逐个判断，直接调用手柄
+    """
+    if state.get(name, 0) == value:
+        return False
+    state[name] = value
+    if mode == GamepadMode.XBOX:
+        button = legacy_button_map_xbox.get(name)
+        if button is not None:
+            if value == 0:
+                gamepad.release_button(button)
+            else:
+                gamepad.press_button(button)
+        elif name == "LT":
+            gamepad.left_trigger_float(value)
+        elif name == "RT":
+            gamepad.right_trigger_float(value)
+        elif name in {"LSx", "LSy", "RSx", "RSy"}:
+            pass  # 摇杆在报告前统一写入
+        else:
+            del state[name]
+            return False
+    else:
+        button_ds4 = legacy_button_map_ds4.get(name)
+        if button_ds4 == "DPAD":
+            dpad_x = 0
+            if state.get("left", 0) != 0:
+                dpad_x -= 1
+            if state.get("right", 0) != 0:
+                dpad_x += 1
+            dpad_y = 0
+            if state.get("up", 0) != 0:
+                dpad_y -= 1
+            if state.get("down", 0) != 0:
+                dpad_y += 1
+            gamepad.directional_pad(legacy_direction_map_ds4[(dpad_x, dpad_y)])
+        elif button_ds4 is not None and button_ds4.startswith("DS4_SPECIAL"):
+            if value == 0:
+                gamepad.release_special_button(button_ds4)
+            else:
+                gamepad.press_special_button(button_ds4)
+        elif button_ds4 is not None:
+            if value == 0:
+                gamepad.release_button(button_ds4)
+            else:
+                gamepad.press_button(button_ds4)
+        elif name == "LT":
+            gamepad.left_trigger_float(value)
+        elif name == "RT":
+            gamepad.right_trigger_float(value)
+        elif name in {"LSx", "LSy", "RSx", "RSy"}:
+            pass
+        else:
+            del state[name]
+            return False
+    return True
+
+
+def table_apply_state(session: Session) -> Callable[[str, float], bool]:
+    """
+    现在的做法：事件循环里的 apply_state 加上驱动线程里查表得到的处理函数，
+    和对照组一样每个字段都调用一次手柄
+    """
+    handlers = session.handlers
+
+    def apply(name: str, value: float) -> bool:
+        if session.apply_state(name, value):
+            handlers[field_id[name]](value)
+            return True
+        return False
+
+    return apply
+
+
+def make_fields() -> List[Tuple[str, float]]:
+    """
+    模拟触摸输入：大部分是摇杆，夹杂扳机和按键(包括方向键)
+    """
+    fields: List[Tuple[str, float]] = []
+    for i in range(ROUNDS):
+        v = (i % 200) / 100 - 1
+        fields.append(("LSx", v))
+        fields.append(("LSy", -v))
+        if i % 4 == 0:
+            fields.append(("RT", abs(v)))
+        if i % 16 == 0:
+            fields.append(("A", i % 32 // 16))
+            fields.append(("up", i % 32 // 16))
+    return fields
+
+
+def measure(
+    apply: Callable[[str, float], Union[bool, None]],
+    fields: List[Tuple[str, float]],
+) -> float:
+    start = time.perf_counter_ns()
+    for name, value in fields:
+        apply(name, value)
+    return (time.perf_counter_ns() - start) / len(fields)
+
+
+async def bench() -> None:
+    """
+    使用 null 后端测量 Session 本身的开销，不需要 ViGEmBus
+    """
+    fields = make_fields()
+    print(f"{len(fields)} fields per run")
+    backend = NullBackend()
+    pool = GamepadPool(backend)
+    # 分派表相对于逐个判断的改进
+    for mode in (GamepadMode.XBOX, GamepadMode.DS4):
+        legacy = measure(partial(legacy_apply_state, {}, LegacyGamepad(), mode), fields)
+        session = Session(0, None, Driver(), pool)  # type: ignore
+        session.set_gamepad(backend.create(mode), mode)
+        table = measure(table_apply_state(session), fields)
+        print(
+            f"{mode.name:5}: legacy {legacy:7.1f} ns/field,"
+            f" table {table:7.1f} ns/field,"
+            f" {(1 - table / legacy) * 100:5.1f}% less"
+        )
+    session = Session(0, None, Driver(), pool)  # type: ignore
+    session.set_gamepad(await pool.acquire(GamepadMode.XBOX), GamepadMode.XBOX)
+    loop = measure(session.apply_state, fields)
+    print(f"event loop   : {loop:7.1f} ns/field")
+    # 驱动线程：每份报告按分派表写入变化的字段
+    session.state.clear()
+    session.set_gamepad(await pool.acquire(GamepadMode.XBOX), GamepadMode.XBOX)
+    reports: List[List[float]] = []
+    for name, value in fields[:DRIVER_ROUNDS]:
+        if session.apply_state(name, value):
+            reports.append(session.state.values[:])
+    start = time.perf_counter_ns()
+    for report in reports:
+        session.write_report(report)
+    driver = (time.perf_counter_ns() - start) / len(reports)
+    print(f"driver thread: {driver:7.1f} ns/report")
+    await pool.close()
+
+
+def main() -> None:
+    asyncio.run(bench())
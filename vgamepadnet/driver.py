@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Optional, TypeVar
+
+from .metrics import Histogram
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+STALL_MS = 20  # 单次驱动调用超过这个时间就记录警告
+
+
+class Job:
+    """
+    驱动线程队列里的一项
+    """
+
+    __slots__ = ("key", "write", "report", "call")
+
+    def __init__(
+        self,
+        key: object,
+        write: Optional[Callable[[Any], None]],
+        report: Any,
+        call: bool = False,
+    ) -> None:
+        self.key = key  # 所属手柄
+        self.write = write  # None 表示停止线程
+        self.report = report
+        self.call = call  # 是否是 call() 提交的其他调用(不是报告)
+
+
+class Driver:
+    """
+    驱动线程。vgamepad 的调用(插入设备、发送报告等)都是同步的 ctypes 调用，
+    放在这个线程里执行，事件循环只负责把任务放进队列
+    """
+
+    def __init__(self) -> None:
+        self.queue: Deque[Job] = deque()
+        # 每个手柄还在队列里、可以被新报告覆盖的那一项
+        self.latest: Dict[object, Job] = {}
+        # 只保护 queue 和 latest，持有时不调用驱动
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+        self.submit_count = 0  # 提交的报告数
+        self.coalesced = 0  # 被更新的报告覆盖掉的报告数
+        self.depth_max = 0  # 队列的最大长度
+        self.call_count = 0  # 实际执行的驱动调用数
+        self.call_time_total = 0.0  # 驱动调用的总耗时(秒)
+        self.call_time_max = 0.0
+        self.stalls = 0  # 超过 STALL_MS 的驱动调用数
+        self.report_latency = Histogram()  # 发送报告(update)耗时的分布
+        self.call_latency = Histogram()  # 其他驱动调用耗时的分布
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name="driver", daemon=True)
+        self.thread.start()
+
+    async def stop(self) -> None:
+        """
+        执行完队列里剩下的任务后停止线程
+        """
+        thread = self.thread
+        if thread is None:
+            return
+        self.put(Job(None, None, None))
+        await asyncio.get_running_loop().run_in_executor(None, thread.join)
+        self.thread = None
+        log.info(self.summary())
+
+    def depth(self) -> int:
+        return len(self.queue)
+
+    def put(self, job: Job) -> None:
+        with self.lock:
+            # 之后的报告不能越过这一项
+            self.latest.pop(job.key, None)
+            self.queue.append(job)
+            self.depth_max = max(self.depth_max, len(self.queue))
+        self.wakeup.set()
+
+    def submit(
+        self,
+        key: object,
+        write: Callable[[T], None],
+        report: T,
+        keep: bool = False,
+    ) -> None:
+        """
+        提交一份报告。同一个手柄的上一份报告还没执行时直接覆盖它(只保留最新的)。
+        keep=True 时(如按键变化)这份报告不会再被之后的报告覆盖，保证游戏能看到
+        """
+        if self.thread is None:
+            self.run_job(write, report, self.report_latency)
+            return
+        with self.lock:
+            self.submit_count += 1
+            job = self.latest.get(key)
+            if job is not None:
+                job.report = report
+                self.coalesced += 1
+            else:
+                job = Job(key, write, report)
+                self.queue.append(job)
+                self.depth_max = max(self.depth_max, len(self.queue))
+                self.latest[key] = job
+            if keep:
+                del self.latest[key]
+        self.wakeup.set()
+
+    async def call(self, key: object, func: Callable[[], T]) -> T:
+        """
+        在驱动线程里执行 func 并等待结果，和同一个手柄的报告保持顺序
+        """
+        if self.thread is None:
+            return func()
+        future: "Future[T]" = Future()
+
+        def write(_: None) -> None:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(func())
+            except BaseException as e:
+                future.set_exception(e)
+
+        self.put(Job(key, write, None, call=True))
+        return await asyncio.wrap_future(future)
+
+    def run(self) -> None:
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                if not self.queue:
+                    self.wakeup.clear()
+                    continue
+                job = self.queue.popleft()
+                if self.latest.get(job.key) is job:
+                    del self.latest[job.key]
+            if job.write is None:
+                break
+            latency = self.call_latency if job.call else self.report_latency
+            self.run_job(job.write, job.report, latency)
+
+    def run_job(
+        self, write: Callable[[Any], None], report: Any, latency: Histogram
+    ) -> None:
+        start = time.perf_counter()
+        try:
+            write(report)
+        except Exception:
+            log.error(traceback.format_exc())
+        elapsed = time.perf_counter() - start
+        self.call_count += 1
+        self.call_time_total += elapsed
+        self.call_time_max = max(self.call_time_max, elapsed)
+        latency.observe(elapsed)
+        if elapsed * 1000 > STALL_MS:
+            self.stalls += 1
+            log.warning(
+                "driver stall: %.1fms, %d queued", elapsed * 1000, len(self.queue)
+            )
+
+    def summary(self) -> str:
+        avg = self.call_time_total / self.call_count if self.call_count > 0 else 0.0
+        return (
+            f"driver: {self.call_count} calls,"
+            f" avg {avg * 1000:.2f}ms max {self.call_time_max * 1000:.2f}ms,"
+            f" {self.stalls} stalls, {self.coalesced}/{self.submit_count} reports"
+            f" coalesced, queue max {self.depth_max}"
+        )
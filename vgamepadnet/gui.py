@@ -5,11 +5,11 @@ import queue
 import math
 import traceback
 from dataclasses import dataclass
-from typing import Callable, Dict, Set, Union, DefaultDict, List, Type, Optional
+from typing import Callable, Dict, Set, Union, List, Type, Optional
 from types import TracebackType
-from copy import deepcopy
 
-from .session import Session, GamepadMode
+from .backend import GamepadMode
+from .session import Session, SessionSnapshot
 
 log = logging.getLogger(__name__)
 
@@ -43,31 +43,10 @@ button_symbol_ds4 = {
 }
 
 
-@dataclass
-class SessionState:
-    gamepad_mode: GamepadMode
-
-    state: DefaultDict[str, Union[int, float]]
-    state_out: DefaultDict[str, Union[int, float]]
-
-    @classmethod
-    def from_session(cls, session: Session) -> "SessionState":
-        return cls(
-            gamepad_mode=session.gamepad_mode,
-            state=deepcopy(session.state),
-            state_out=deepcopy(session.state_out),
-        )
-
-
 @dataclass
 class SessionAddEvent:
     session_id: int
-
-
-@dataclass
-class SessionChangeEvent:
-    session_id: int
-    state: SessionState
+    session: Session
 
 
 @dataclass
@@ -87,7 +66,6 @@ class ErrorEvent:
 
 GUIEvent = Union[
     SessionAddEvent,
-    SessionChangeEvent,
     SessionDelEvent,
     ErrorEvent,
     LinkUpdateEvent,
@@ -122,6 +100,9 @@ class GUI:
 
         self.queue: queue.Queue[GUIEvent] = queue.Queue()
         self.session_named: Dict[int, tkinter.Widget] = {}
+        # 每个周期检查这些会话的版本号，只重画有变化的
+        self.session_sources: Dict[int, Session] = {}
+        self.session_drawn: Dict[int, int] = {}  # 已经画出的版本号
         self.on_link_refresh_button_click: Set[Callable[[], None]] = set()
         self.on_close: Set[Callable[[], None]] = set()
         self.closed = False
@@ -174,21 +155,16 @@ class GUI:
         self.closed = True
 
     def cycle_queue(self) -> None:
-        toAdd: Set[int] = set()
-        toChange: Dict[int, SessionState] = {}
+        toAdd: Dict[int, Session] = {}
         toDel: Set[int] = set()
         while True:
             try:
                 event = self.queue.get_nowait()
                 if isinstance(event, SessionAddEvent):
                     # 不需要todel.remove，删除后重新添加
-                    toAdd.add(event.session_id)
-                elif isinstance(event, SessionChangeEvent):
-                    toChange[event.session_id] = event.state
+                    toAdd[event.session_id] = event.session
                 elif isinstance(event, SessionDelEvent):
-                    toAdd.discard(event.session_id)
-                    if event.session_id in toChange:
-                        toChange.pop(event.session_id)
+                    toAdd.pop(event.session_id, None)
                     toDel.add(event.session_id)
                 elif isinstance(event, LinkUpdateEvent):
                     self.link_update(event.links)
@@ -202,15 +178,20 @@ class GUI:
                 break
         for session_id in toDel:
             self.session_del(session_id)
-        for session_id in toAdd:
-            self.session_add(session_id)
-        for session_id, state in toChange.items():
-            self.session_change(session_id, state)
+        for session_id, session in toAdd.items():
+            self.session_add(session_id, session)
+        for session_id, session in self.session_sources.items():
+            if session.version != self.session_drawn[session_id]:
+                state = session.snapshot()
+                self.session_drawn[session_id] = state.version
+                self.session_change(session_id, state)
         self.root.after(CYCLE_MS, self.cycle_queue)
 
-    def session_add(self, session_id: int) -> None:
+    def session_add(self, session_id: int, session: Session) -> None:
         if self.closed:
             return
+        self.session_sources[session_id] = session
+        self.session_drawn[session_id] = -1
         session_id_frame = tkinter.Frame(self.sessions)
         session_id_frame.pack()
         session_id_tag = tkinter.Label(
@@ -235,7 +216,7 @@ class GUI:
         sign.pack(side="left")
         self.session_named[session_id] = session_id_frame
 
-    def session_change(self, session_id: int, state: SessionState) -> None:
+    def session_change(self, session_id: int, state: SessionSnapshot) -> None:
         if self.closed:
             return
         label = self.session_named[session_id]
@@ -377,6 +358,8 @@ class GUI:
             px += 30
 
     def session_del(self, session_id: int) -> None:
+        self.session_sources.pop(session_id, None)
+        self.session_drawn.pop(session_id, None)
         if self.closed:
             return
         self.session_named[session_id].pack_forget()
@@ -0,0 +1,383 @@
+import argparse
+import asyncio
+import logging
+import math
+import multiprocessing
+import multiprocessing.queues
+import queue
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import aiohttp
+
+from . import protocol
+from . import trace
+from .backend_null import NullBackend
+from .server import Server
+from .trace import tracer
+
+HOST = "127.0.0.1"
+PORT = 35798
+PATH_PREFIX = "loadtest"
+RESUME_GRACE = 30
+REPORTS_KEPT = 100  # null 手柄只需要保留很少的报告
+TRACE_EVENTS_MAX = 2000000  # 记录延迟用的 trace 缓冲区上限
+LAG_INTERVAL = 0.01  # 测量事件循环延迟的间隔(秒)
+
+
+@dataclass
+class Options:
+    clients: int
+    seconds: float
+    rate: float  # 每个客户端每秒发送的帧数
+    proto: str  # "text" 或 "binary"
+    mode_every: float  # 每隔多少秒切换一次手柄模式，0 表示不切换
+    reconnect_every: float  # 每隔多少秒所有客户端同时断线重连，0 表示不重连
+    replay: Optional[str]  # 录制的消息文件，每行一条 set 命令
+    port: int
+
+
+@dataclass
+class ClientStats:
+    frames: int = 0
+    connects: int = 0
+    mode_switches: int = 0
+    errors: int = 0
+
+
+def load_replay(path: str) -> List[str]:
+    """
+    读取录制的消息。可以直接使用 DEBUG 级别的 debug.log，只取其中 "> set ..." 的部分
+    """
+    frames: List[str] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if "> " in line:
+                line = line[line.rindex("> ") + 2 :]
+            if line.startswith("set "):
+                frames.append(line)
+    if not frames:
+        raise ValueError(f"No set commands in {path!r}")
+    return frames
+
+
+def synthetic_frame(
+    index: int, clients: int, seq: int, t: float, proto: str
+) -> Union[str, bytes]:
+    """
+    模拟手指在屏幕上画圈：左摇杆转圈，右扳机来回，A 键每秒按两次。
+    各客户端的相位错开，避免所有报告同时变化
+    """
+    angle = 2 * math.pi * (t * 0.5 + index / clients)
+    x = math.cos(angle)
+    y = math.sin(angle)
+    rt = (math.sin(t * 3) + 1) / 2
+    a = int(t * 4) % 2
+    time_ms = int(t * 1000)
+    if proto == "binary":
+        return protocol.STATE_SEQ_FRAME.pack(
+            protocol.FRAME_STATE_SEQ,
+            seq % protocol.SEQ_MOD,
+            time_ms % protocol.SEQ_MOD,
+            a << protocol.BUTTON_FIELDS.index("A"),
+            0,
+            int(rt * protocol.TRIGGER_MAX),
+            int(x * protocol.STICK_MAX),
+            int(y * protocol.STICK_MAX),
+            0,
+            0,
+        )
+    return f"set seq {seq} time {time_ms} LSx {x:.4f} LSy {y:.4f} RT {rt:.3f} A {a}"
+
+
+async def drain(ws: aiohttp.ClientWebSocketResponse) -> None:
+    """
+    读掉服务器发来的反馈，不然服务器的发送缓冲区会一直增长
+    """
+    async for _ in ws:
+        pass
+
+
+async def run_client(
+    index: int,
+    options: Options,
+    replay: Optional[List[str]],
+    start: float,
+    stats: ClientStats,
+) -> None:
+    loop = asyncio.get_running_loop()
+    url = f"http://{HOST}:{options.port}/{PATH_PREFIX}/websocket"
+    end = start + options.seconds
+    token: Optional[str] = None
+    seq = 0
+    modes = ("xbox", "ds4")
+    mode_index = 0
+    next_mode = start + options.mode_every
+    interval = 1 / options.rate
+    async with aiohttp.ClientSession() as http:
+        while loop.time() < end:
+            # 所有客户端在同一时刻断线，模拟路由器重启等情况
+            if options.reconnect_every > 0:
+                elapsed = loop.time() - start
+                disconnect_at = start + options.reconnect_every * (
+                    math.floor(elapsed / options.reconnect_every) + 1
+                )
+                disconnect_at = min(disconnect_at, end)
+            else:
+                disconnect_at = end
+            try:
+                async with http.ws_connect(
+                    url if token is None else f"{url}?resume={token}"
+                ) as ws:
+                    hello = (await ws.receive_str()).split(" ")
+                    token = hello[hello.index("resume_token") + 1]
+                    stats.connects += 1
+                    await ws.send_str(f"mode {modes[mode_index]}")
+                    reader = asyncio.create_task(drain(ws))
+                    next_tick = loop.time()
+                    try:
+                        while next_tick < disconnect_at:
+                            now = loop.time()
+                            if options.mode_every > 0 and now >= next_mode:
+                                mode_index = 1 - mode_index
+                                await ws.send_str(f"mode {modes[mode_index]}")
+                                stats.mode_switches += 1
+                                next_mode += options.mode_every
+                            seq += 1
+                            if replay is not None:
+                                await ws.send_str(replay[seq % len(replay)])
+                            else:
+                                frame = synthetic_frame(
+                                    index, options.clients, seq, now, options.proto
+                                )
+                                if isinstance(frame, bytes):
+                                    await ws.send_bytes(frame)
+                                else:
+                                    await ws.send_str(frame)
+                            stats.frames += 1
+                            next_tick += interval
+                            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+                    finally:
+                        reader.cancel()
+            except Exception:
+                stats.errors += 1
+                await asyncio.sleep(0.1)
+
+
+async def run_clients(
+    options: Options, replay: Optional[List[str]], stats: List[ClientStats]
+) -> None:
+    start = asyncio.get_running_loop().time()
+    await asyncio.gather(
+        *(
+            run_client(index, options, replay, start, stats[index])
+            for index in range(options.clients)
+        )
+    )
+
+
+ClientResults = Tuple[List[ClientStats], float]  # 各客户端的统计, 运行时长(秒)
+
+
+def client_process(
+    options: Options,
+    replay: Optional[List[str]],
+    results: "multiprocessing.queues.Queue[ClientResults]",
+) -> None:
+    """
+    (客户端进程) 运行所有客户端，把统计交回服务器所在的进程
+    """
+    stats = [ClientStats() for _ in range(options.clients)]
+    start = time.perf_counter()
+    asyncio.run(run_clients(options, replay, stats))
+    results.put((stats, time.perf_counter() - start))
+
+
+def wait_clients(
+    process: multiprocessing.Process,
+    results: "multiprocessing.queues.Queue[ClientResults]",
+) -> ClientResults:
+    """
+    等待客户端进程交回统计，进程异常退出时抛出异常而不是一直等待
+    """
+    while True:
+        try:
+            result = results.get(timeout=0.5)
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(
+                    f"Client process exited with code {process.exitcode}"
+                )
+            continue
+        process.join()
+        return result
+
+
+async def monitor_lag(samples: List[float]) -> None:
+    """
+    记录事件循环比预定时间晚醒来多久
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        before = loop.time()
+        await asyncio.sleep(LAG_INTERVAL)
+        samples.append(loop.time() - before - LAG_INTERVAL)
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    """
+    values 需要已经排好序
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def apply_latencies() -> List[float]:
+    """
+    从 trace 里取出每个状态帧从收到到修改状态的耗时(秒)，已排序。
+    切换模式等控制消息没有 APPLY 事件，不计入
+    """
+    received: Dict[Tuple[int, int], int] = {}
+    applied: Dict[Tuple[int, int], int] = {}
+    for event in tracer.events:
+        if event is None:
+            continue
+        ts, stage, session_id, input_id = event
+        if stage == trace.RECEIVE:
+            received[session_id, input_id] = ts
+        elif stage == trace.APPLY:
+            applied.setdefault((session_id, input_id), ts)
+    return sorted(
+        (ts - received[key]) / 1e9 for key, ts in applied.items() if key in received
+    )
+
+
+def peak_rss_mib() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        # Windows 上没有 resource 模块
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 的单位是字节，Linux 是 KiB
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def format_ms(values: Sequence[float]) -> str:
+    return (
+        f"p50 {percentile(values, 0.5) * 1000:.2f}ms"
+        f" p99 {percentile(values, 0.99) * 1000:.2f}ms"
+        f" p999 {percentile(values, 0.999) * 1000:.2f}ms"
+        f" max {(values[-1] if values else 0.0) * 1000:.2f}ms"
+    )
+
+
+async def loadtest(options: Options) -> None:
+    """
+    在本进程里启动使用 null 后端的 Server，客户端在另一个进程里运行，
+    这样 GIL 的争用、事件循环延迟和内存占用都只属于服务器
+    """
+    replay = load_replay(options.replay) if options.replay is not None else None
+    # 每个状态帧最多记录 RECEIVE、PARSE、APPLY、UPDATE 四个事件，控制消息只有前两个
+    expected = int(options.clients * options.rate * options.seconds * 4)
+    tracer.enable(min(max(expected, 1000), TRACE_EVENTS_MAX))
+    backend = NullBackend(keep=REPORTS_KEPT)
+    server = Server(backend=backend, pool_size=1, resume_grace=RESUME_GRACE)
+    server_task = asyncio.create_task(server.run(HOST, options.port, PATH_PREFIX))
+    while server.site is None:
+        if server_task.done():
+            await server_task  # 启动失败(如端口被占用)
+        await asyncio.sleep(0.05)
+
+    lag: List[float] = []
+    lag_task = asyncio.create_task(monitor_lag(lag))
+    results: "multiprocessing.queues.Queue[ClientResults]" = multiprocessing.Queue()
+    clients = multiprocessing.Process(
+        target=client_process,
+        args=(options, replay, results),
+        name="loadtest-clients",
+    )
+    clients.start()
+    # 速率按客户端实际发送的时长计算，不包括启动进程的时间
+    stats, elapsed = await asyncio.get_running_loop().run_in_executor(
+        None, wait_clients, clients, results
+    )
+    # 等服务器处理完积压的消息
+    await asyncio.sleep(0.2)
+    lag_task.cancel()
+
+    sessions = list(server.clients)
+    fields = sum(session.fields_applied for session in sessions)
+    updates = sum(session.update_count for session in sessions)
+    messages = sum(session.message_count for session in sessions)
+    merged = sum(session.frames_merged for session in sessions)
+    writes = sum(gamepad.update_count for gamepad in backend.gamepads)
+    latencies = apply_latencies()
+    lag.sort()
+    await server.close()
+    await server_task
+
+    frames = sum(s.frames for s in stats)
+    print(
+        f"{options.clients} clients, {options.rate:g} frames/s each,"
+        f" {elapsed:.1f}s, {'replay' if replay is not None else options.proto}"
+    )
+    print(
+        f"clients : {frames} frames sent, {sum(s.connects for s in stats)} connects,"
+        f" {sum(s.mode_switches for s in stats)} mode switches,"
+        f" {sum(s.errors for s in stats)} errors"
+    )
+    print(
+        f"server  : {messages / elapsed:9.1f} messages/s, {fields / elapsed:9.1f}"
+        f" fields/s, {updates / elapsed:9.1f} reports/s, {merged} frames merged"
+    )
+    print(f"driver  : {writes / elapsed:9.1f} updates/s, {server.driver.summary()}")
+    print(f"apply   : {len(latencies)} state frames, {format_ms(latencies)}")
+    print(f"loop lag: {format_ms(lag)} (server only, clients run in a subprocess)")
+    rss = peak_rss_mib()
+    print(f"rss     : {'n/a' if rss is None else f'{rss:.1f}MiB peak, server only'}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> Options:
+    parser = argparse.ArgumentParser(
+        description="Start a Server on the null backend and load it with"
+        " simulated phones"
+    )
+    parser.add_argument("-n", "--clients", type=int, default=8)
+    parser.add_argument("-t", "--seconds", type=float, default=10)
+    parser.add_argument("-r", "--rate", type=float, default=120)
+    parser.add_argument("--proto", choices=("text", "binary"), default="text")
+    parser.add_argument(
+        "--mode-every", type=float, default=0, help="switch xbox/ds4 every N seconds"
+    )
+    parser.add_argument(
+        "--reconnect-every",
+        type=float,
+        default=0,
+        help="drop and resume all clients at once every N seconds",
+    )
+    parser.add_argument(
+        "--replay", help="text file of recorded 'set ...' commands (e.g. debug.log)"
+    )
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args(argv)
+    return Options(
+        clients=args.clients,
+        seconds=args.seconds,
+        rate=args.rate,
+        proto=args.proto,
+        mode_every=args.mode_every,
+        reconnect_every=args.reconnect_every,
+        replay=args.replay,
+        port=args.port,
+    )
+
+
+def main() -> None:
+    options = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(loadtest(options))
@@ -1,26 +1,60 @@
 import logging
+import logging.handlers
+import queue
 import traceback
 import asyncio
 import base64
 import os
 import threading
 import socket
-from typing import List
+from typing import List, Optional
 
+from .backend import load_backend
 from .session import Session
 from .server import Server
+from .trace import tracer
 from . import gui
 from .gui import GUI
 
-import tracemalloc
-
-tracemalloc.start()
 log = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO, filename="debug.log", filemode="a")
-# logging.basicConfig(level=logging.DEBUG)
 
 HOST = "0.0.0.0"
 PORT = 35714
+# 每个手柄每秒最多发送报告的次数(如 60/125)，None 表示收到数据就立即发送。
+# asyncio 的定时精度受系统计时器限制：Windows 默认约 15.6ms，实际每秒最多约 64 次，
+# 更高的值在 Windows 上没有效果；按键和扳机的按下/松开总是立即发送，不受这个限制
+REPORT_RATE: Optional[int] = None
+# 虚拟手柄后端，"vigem" 使用 ViGEmBus 驱动，"null" 只在内存里记录报告(用于测试)
+BACKEND = "vigem"
+# 每种手柄(Xbox/DS4)预先插入的数量，切换模式时不用再等待插入设备。
+# 预先插入的手柄在系统里会显示为已连接的手柄，所以默认为 0(不预先插入)
+POOL_SIZE = 0
+# 连接断开后保留手柄的秒数，期间手机重新连接会继续使用同一个手柄和编号
+RESUME_GRACE = 30
+# 每秒最多发送给手机的震动/LED 反馈数，None 表示不限制
+FEEDBACK_RATE: Optional[float] = 60
+# 记录输入延迟 trace 的事件数(/trace 导出)，0 表示不记录
+TRACE_EVENTS = 0
+LOG_LEVEL = logging.INFO  # 调试时改成 logging.DEBUG
+LOG_MAX_BYTES = 5 * 1024 * 1024  # debug.log 超过这个大小就换新文件
+LOG_BACKUPS = 3  # 保留的旧日志数(debug.log.1 ...)
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """
+    日志先放进队列，由单独的线程写入文件，写磁盘慢的时候不会拖慢事件循环
+    """
+    handler = logging.handlers.RotatingFileHandler(
+        "debug.log", maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8"
+    )
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    records: "queue.Queue[logging.LogRecord]" = queue.Queue()
+    listener = logging.handlers.QueueListener(records, handler)
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    listener.start()
+    return listener
 
 
 def get_path_prefix() -> str:
@@ -40,32 +74,35 @@ def get_path_prefix() -> str:
 
 
 async def server_main(guiwindow: GUI) -> None:
-    server = Server()
+    if TRACE_EVENTS > 0:
+        tracer.enable(TRACE_EVENTS)
+    server = Server(
+        report_rate=REPORT_RATE,
+        backend=load_backend(BACKEND),
+        pool_size=POOL_SIZE,
+        resume_grace=RESUME_GRACE,
+        feedback_rate=FEEDBACK_RATE,
+    )
 
     def server_close_threadsafe() -> None:
         asyncio.run_coroutine_threadsafe(server.close(), server.main_loop)
 
     async def gui_session_add(server: Server, session: Session) -> None:
-        guiwindow.queue.put(gui.SessionAddEvent(session.session_id))
-        session.on_change.add(gui_session_change)
-
-    async def gui_session_change(session: Session) -> None:
-        guiwindow.queue.put(
-            gui.SessionChangeEvent(
-                session.session_id, gui.SessionState.from_session(session)
-            )
-        )
+        # 界面每个周期自己检查会话的版本号，这里只登记一次
+        guiwindow.queue.put(gui.SessionAddEvent(session.session_id, session))
 
     async def gui_session_del(server: Server, session: Session) -> None:
         guiwindow.queue.put(gui.SessionDelEvent(session.session_id))
-        session.on_change.remove(gui_session_change)
 
     path_prefix = get_path_prefix()
 
     def gui_links() -> None:
         links: List[str] = []
+        hosts: List[str] = []
         for ipaddr in socket.gethostbyname_ex(socket.gethostname())[2]:
             links.append(f"http://{ipaddr}:{PORT}/{path_prefix}/")
+            hosts.append(f"{ipaddr}:{PORT}")
+        server.hosts = hosts
         guiwindow.queue.put(gui.LinkUpdateEvent(links))
 
     server.on_connect.add(gui_session_add)
@@ -90,6 +127,7 @@ def server_thread_func(guiwindow: GUI) -> None:
 
 
 def main() -> None:
+    log_listener = setup_logging()
     try:
         guiwindow = GUI()
         server_thread = threading.Thread(
@@ -100,3 +138,6 @@ def main() -> None:
         server_thread.join()
     except Exception:
         log.error(traceback.format_exc())
+    finally:
+        # 写完队列里剩下的日志
+        log_listener.stop()
@@ -0,0 +1,85 @@
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence
+
+# 驱动调用耗时的分桶上限(秒)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02, 0.05)
+
+
+class Histogram:
+    """
+    固定分桶的直方图，记录时只做一次二分查找和加法，导出时才计算累计值
+    """
+
+    __slots__ = ("bounds", "counts", "total")
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 最后一个桶是 +Inf
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+
+def format_labels(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    return f"{{{inner}}}"
+
+
+class Exposition:
+    """
+    生成 Prometheus 文本格式，只在请求 /metrics 时使用
+    """
+
+    def __init__(self) -> None:
+        self.lines: List[str] = []
+        self.declared: Dict[str, str] = {}
+
+    def declare(self, name: str, kind: str, help: str) -> None:
+        """
+        同一个指标只输出一次 HELP 和 TYPE
+        """
+        if name in self.declared:
+            return
+        self.declared[name] = kind
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(
+        self,
+        name: str,
+        kind: str,
+        help: str,
+        value: float,
+        labels: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.declare(name, kind, help)
+        self.lines.append(f"{name}{format_labels(labels)} {value}")
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        histogram: Histogram,
+        labels: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.declare(name, "histogram", help)
+        labels = labels or {}
+        # 在驱动线程里记录，先复制一份避免导出过程中数值变化
+        counts = histogram.counts[:]
+        total = histogram.total
+        cumulative = 0
+        for bound, count in zip(list(histogram.bounds) + [float("inf")], counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            self.lines.append(
+                f"{name}_bucket{format_labels({**labels, 'le': le})} {cumulative}"
+            )
+        self.lines.append(f"{name}_sum{format_labels(labels)} {total}")
+        self.lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, TypeVar
+
+from .backend import Backend, Gamepad, GamepadMode
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+POOL_MODES = (GamepadMode.XBOX, GamepadMode.DS4)
+
+
+def log_exception(future: "Future[Any]") -> None:
+    exc = future.exception()
+    if exc is not None:
+        log.error(
+            "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+        )
+
+
+class GamepadPool:
+    """
+    预先插入的虚拟手柄。插入和移除设备很慢而且 Windows 会播放提示音，
+    这些操作都在池自己的线程里进行，不会拖慢驱动线程发送其他手柄的报告。
+    切换模式和重新连接时直接借用已经插好的手柄，借出后在后台补充
+    """
+
+    def __init__(self, backend: Backend, size: int = 0) -> None:
+        self.backend = backend
+        self.size = size  # 每种手柄最多保留的空闲数量，0 表示不预先插入
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pool")
+
+        # 以下只在池的线程里修改
+        self.idle: Dict[GamepadMode, List[Gamepad]] = {mode: [] for mode in POOL_MODES}
+        self.leased = 0  # 正在被会话使用的手柄数
+
+        self.acquire_count = 0
+        self.acquire_hits = 0  # 直接从池里取到的次数
+        self.acquire_time_total = 0.0  # 借用手柄的总耗时(秒)
+        self.acquire_time_max = 0.0
+
+    def run(self, func: Callable[..., None], *args: Any) -> None:
+        """
+        在池的线程里执行，不等待结果
+        """
+        self.executor.submit(func, *args).add_done_callback(log_exception)
+
+    async def call(self, func: Callable[[], T]) -> T:
+        """
+        在池的线程里执行并等待结果
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func)
+
+    def refill(self) -> None:
+        """
+        在后台把空闲的手柄补充到 size 个
+        """
+        if self.size > 0:
+            self.run(self.fill)
+
+    def fill(self) -> None:
+        """
+        (池的线程) 把每种手柄补充到 size 个
+        """
+        added = 0
+        for mode in POOL_MODES:
+            idle = self.idle[mode]
+            while len(idle) < self.size:
+                idle.append(self.backend.create(mode))
+                added += 1
+        if added > 0:
+            log.info("pool: filled, %s", self.occupancy())
+
+    async def acquire(self, mode: GamepadMode) -> Gamepad:
+        gamepad = await self.call(lambda: self.take(mode))
+        self.refill()
+        return gamepad
+
+    def take(self, mode: GamepadMode) -> Gamepad:
+        """
+        (池的线程) 取出一个空闲的手柄，没有时插入新的
+        """
+        start = time.perf_counter()
+        idle = self.idle[mode]
+        hit = len(idle) > 0
+        gamepad = idle.pop() if hit else self.backend.create(mode)
+        elapsed = time.perf_counter() - start
+        self.leased += 1
+        self.acquire_count += 1
+        if hit:
+            self.acquire_hits += 1
+        self.acquire_time_total += elapsed
+        self.acquire_time_max = max(self.acquire_time_max, elapsed)
+        log.info(
+            "pool: %s %s in %.2fms, %s",
+            mode.name,
+            "reused" if hit else "created",
+            elapsed * 1000,
+            self.occupancy(),
+        )
+        return gamepad
+
+    def release(self, gamepad: Gamepad, mode: GamepadMode) -> None:
+        """
+        归还手柄，可以在任何线程里调用，实际操作在池的线程里进行
+        """
+        self.run(self.put_back, gamepad, mode)
+
+    def put_back(self, gamepad: Gamepad, mode: GamepadMode) -> None:
+        """
+        (池的线程) 先恢复到没有按下任何按键的状态。池满时移除设备
+        """
+        self.leased -= 1
+        gamepad.unregister_notification()
+        gamepad.reset()
+        gamepad.update()
+        idle = self.idle.get(mode)
+        if idle is not None and len(idle) < self.size:
+            idle.append(gamepad)
+        else:
+            gamepad.close()
+
+    def clear(self) -> None:
+        """
+        (池的线程) 移除所有空闲的手柄
+        """
+        for idle in self.idle.values():
+            for gamepad in idle:
+                gamepad.close()
+            idle.clear()
+
+    async def close(self) -> None:
+        """
+        等之前归还的手柄处理完，移除所有空闲的手柄并停止线程
+        """
+        await self.call(self.clear)
+        self.executor.shutdown(wait=False)
+
+    def occupancy(self) -> str:
+        idle = ", ".join(f"{mode.name} {len(pads)}" for mode, pads in self.idle.items())
+        return f"idle {idle}, leased {self.leased}"
+
+    def summary(self) -> str:
+        avg = (
+            self.acquire_time_total / self.acquire_count
+            if self.acquire_count > 0
+            else 0.0
+        )
+        return (
+            f"pool: {self.acquire_hits}/{self.acquire_count} acquires reused,"
+            f" avg {avg * 1000:.2f}ms max {self.acquire_time_max * 1000:.2f}ms,"
+            f" {self.occupancy()}"
+        )
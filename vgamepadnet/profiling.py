@@ -0,0 +1,52 @@
+import asyncio
+import logging
+import tracemalloc
+
+log = logging.getLogger(__name__)
+
+PROFILE_SECONDS = 10.0  # 默认的采样时长
+PROFILE_SECONDS_MAX = 300.0  # 采样时长上限，避免 tracemalloc 一直开着
+PROFILE_TOP = 20  # 输出的分配位置数
+PROFILE_FRAMES = 1  # 每个分配记录的调用栈深度
+
+profile_running = False  # 同一时间只能有一次采样
+
+
+async def profile_memory(
+    seconds: float = PROFILE_SECONDS, top: int = PROFILE_TOP
+) -> str:
+    """
+    临时开启 tracemalloc，间隔 seconds 秒拍两次快照，把新增内存最多的位置写进日志并返回。
+    tracemalloc 会拖慢每一次内存分配，所以只在这段时间里开启
+    """
+    global profile_running
+    if profile_running:
+        raise RuntimeError("Memory profile already running")
+    profile_running = True
+    try:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(PROFILE_FRAMES)
+        try:
+            before = tracemalloc.take_snapshot()
+            await asyncio.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started:
+                tracemalloc.stop()
+        # 去掉 tracemalloc 自己拍快照时的分配
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        stats = after.filter_traces(ignore).compare_to(
+            before.filter_traces(ignore), "lineno"
+        )
+        lines = [
+            f"memory profile: {seconds:.1f}s,"
+            f" traced {current / 1024:.1f}KiB peak {peak / 1024:.1f}KiB"
+        ]
+        lines.extend(str(stat) for stat in stats[:top])
+        report = "\n".join(lines)
+        log.info(report)
+        return report
+    finally:
+        profile_running = False
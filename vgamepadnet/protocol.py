@@ -0,0 +1,75 @@
+import struct
+from typing import Dict, List, Tuple
+
+# 二进制帧的字段编号，顺序必须和 web/script.ts 里的 BUTTON_FIELDS 等保持一致
+BUTTON_FIELDS: List[str] = [
+    "up",
+    "down",
+    "left",
+    "right",
+    "start",
+    "back",
+    "LS",
+    "RS",
+    "LB",
+    "RB",
+    "guide",
+    "A",
+    "B",
+    "X",
+    "Y",
+]
+TRIGGER_FIELDS: List[str] = ["LT", "RT"]
+STICK_FIELDS: List[str] = ["LSx", "LSy", "RSx", "RSy"]
+
+# 会话状态数组的布局，字段编号就是在这里的下标
+FIELDS: List[str] = BUTTON_FIELDS + TRIGGER_FIELDS + STICK_FIELDS
+FIELD_ID: Dict[str, int] = {name: i for i, name in enumerate(FIELDS)}
+# 服务器发给客户端的字段
+OUTPUT_FIELDS: List[str] = ["session_id", "large_motor", "small_motor", "led_number"]
+OUTPUT_FIELD_ID: Dict[str, int] = {name: i for i, name in enumerate(OUTPUT_FIELDS)}
+
+FRAME_STATE = 1
+FRAME_STATE_SEQ = 2
+
+# 帧类型 uint8, 按键位掩码 uint16, LT RT uint8, LSx LSy RSx RSy int16
+STATE_FRAME = struct.Struct("<BHBBhhhh")
+# 帧类型 uint8, 序号 uint32, 客户端时间(毫秒) uint32, 之后和 STATE_FRAME 相同
+STATE_SEQ_FRAME = struct.Struct("<BIIHBBhhhh")
+SEQ_MOD = 1 << 32
+
+TRIGGER_MAX = 255
+STICK_MAX = 32767
+
+
+def decode_state(data: bytes) -> List[Tuple[str, float]]:
+    """
+    解析完整状态帧，返回 (名字, 数值) 列表
+    """
+    _, buttons, lt, rt, lsx, lsy, rsx, rsy = STATE_FRAME.unpack_from(data)
+    return state_fields(buttons, lt, rt, lsx, lsy, rsx, rsy)
+
+
+def decode_state_seq(data: bytes) -> Tuple[int, int, List[Tuple[str, float]]]:
+    """
+    解析带序号和时间的完整状态帧，返回 (序号, 客户端时间, 字段列表)
+    """
+    _, seq, time_ms, buttons, lt, rt, lsx, lsy, rsx, rsy = STATE_SEQ_FRAME.unpack_from(
+        data
+    )
+    return seq, time_ms, state_fields(buttons, lt, rt, lsx, lsy, rsx, rsy)
+
+
+def state_fields(
+    buttons: int, lt: int, rt: int, lsx: int, lsy: int, rsx: int, rsy: int
+) -> List[Tuple[str, float]]:
+    fields: List[Tuple[str, float]] = [
+        (name, (buttons >> i) & 1) for i, name in enumerate(BUTTON_FIELDS)
+    ]
+    fields.append(("LT", lt / TRIGGER_MAX))
+    fields.append(("RT", rt / TRIGGER_MAX))
+    fields.append(("LSx", lsx / STICK_MAX))
+    fields.append(("LSy", lsy / STICK_MAX))
+    fields.append(("RSx", rsx / STICK_MAX))
+    fields.append(("RSy", rsy / STICK_MAX))
+    return fields
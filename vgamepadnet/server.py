@@ -2,21 +2,77 @@ import logging
 import asyncio
 import traceback
 from pathlib import Path
-from typing import Awaitable, Union, Optional, Callable, Set
+from typing import Awaitable, Dict, List, Union, Optional, Callable, Set, Tuple
 
 from aiohttp import web
 
+from .backend import Backend, load_backend
+from .driver import Driver
+from .metrics import Exposition
+from .pool import GamepadPool
+from .profiling import PROFILE_SECONDS, PROFILE_SECONDS_MAX, profile_memory
 from .session import Session
+from .trace import tracer
 
 log = logging.getLogger(__name__)
 
+# 每个会话导出的指标：名字, 类型, 说明, 取值
+SESSION_METRICS: List[Tuple[str, str, str, Callable[[Session], float]]] = [
+    ("messages_total", "counter", "Messages received", lambda s: s.message_count),
+    ("bytes_total", "counter", "Message bytes received", lambda s: s.message_bytes),
+    (
+        "fields_applied_total",
+        "counter",
+        "Fields that changed state",
+        lambda s: s.fields_applied,
+    ),
+    ("updates_total", "counter", "Reports submitted", lambda s: s.update_count),
+    (
+        "frames_merged_total",
+        "counter",
+        "State frames merged",
+        lambda s: s.frames_merged,
+    ),
+    (
+        "notifications_total",
+        "counter",
+        "Feedback notifications",
+        lambda s: s.feedback_count,
+    ),
+    (
+        "feedback_sent_total",
+        "counter",
+        "Feedback sent",
+        lambda s: s.feedback_out_count,
+    ),
+    (
+        "inbox_depth",
+        "gauge",
+        "Messages received but not handled yet",
+        lambda s: len(s.inbox),
+    ),
+    (
+        "send_tasks",
+        "gauge",
+        "Feedback send tasks still running",
+        lambda s: len(s.background_tasks),
+    ),
+]
+
 
 class Server:
     """
     浏览器可以直接访问的操作服务器
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        report_rate: Optional[int] = None,
+        backend: Optional[Backend] = None,
+        pool_size: int = 0,
+        resume_grace: float = 0,
+        feedback_rate: Optional[float] = None,
+    ) -> None:
         self.runner: Optional[web.AppRunner] = None
         self.app: Optional[web.Application] = None
         self.site: Optional[web.TCPSite] = None
@@ -25,6 +81,20 @@ class Server:
 
         self.clients: Set[Session] = set()
         self.session_id_used: Set[int] = set()
+        self.report_rate = report_rate  # 每个手柄每秒最多发送的报告数
+        self.feedback_rate = feedback_rate  # 每秒最多发送给客户端的震动/LED 反馈数
+        self.driver = Driver()  # 所有手柄共用的驱动线程
+        # 虚拟手柄后端，默认使用 ViGEmBus
+        self.backend = backend if backend is not None else load_backend("vigem")
+        # 每种手柄预先插入 pool_size 个，会话断开后手柄还回池里
+        self.pool = GamepadPool(self.backend, pool_size)
+        # 断线后保留手柄等待重连的秒数，0 表示断线就移除
+        self.resume_grace = resume_grace
+        self.sessions_by_token: Dict[int, Session] = {}
+        self.connect_count = 0  # 新建的会话数
+        self.resume_count = 0  # 断线后重新连接上原来会话的次数
+        # 本机所有地址("IP:端口")，网页会同时尝试连接，使用响应最快的
+        self.hosts: List[str] = []
 
         self.on_connect: Set[Callable[[Server, Session], Awaitable[None]]] = set()
         self.on_disconnect: Set[Callable[[Server, Session], Awaitable[None]]] = set()
@@ -46,34 +116,237 @@ class Server:
     async def dynamic_websocket_handler(
         self, request: web.Request
     ) -> Union[web.WebSocketResponse, web.Response]:
+        start = self.main_loop.time()
         ws = web.WebSocketResponse(heartbeat=2)
         await ws.prepare(request)
-        session_id_next = 1
-        while session_id_next in self.session_id_used:
-            session_id_next += 1
-        self.session_id_used.add(session_id_next)
-        session = Session(session_id_next, ws)
-        self.clients.add(session)
-        for cb in self.on_connect:
-            try:
-                await cb(self, session)
-            except Exception:
-                log.error(traceback.format_exc())
+        session = await self.resume_session(request.query.get("resume"))
+        if session is not None:
+            self.resume_count += 1
+            session.attach(ws)
+            log.info(
+                "session %d: resumed in %.2fms after %.2fs offline",
+                session.session_id,
+                (self.main_loop.time() - start) * 1000,
+                max(0.0, start - session.stopped_at),
+            )
+        else:
+            session_id_next = 1
+            while session_id_next in self.session_id_used:
+                session_id_next += 1
+            self.session_id_used.add(session_id_next)
+            session = Session(
+                session_id_next,
+                ws,
+                self.driver,
+                self.pool,
+                report_rate=self.report_rate,
+                feedback_rate=self.feedback_rate,
+            )
+            self.connect_count += 1
+            self.clients.add(session)
+            self.sessions_by_token[session.resume_token] = session
+            for cb in self.on_connect:
+                try:
+                    await cb(self, session)
+                except Exception:
+                    log.error(traceback.format_exc())
         await session.run()
+        if (
+            self.resume_grace > 0
+            and session.gamepad is not None
+            and not self._close_event.is_set()
+        ):
+            session.expire_task = asyncio.create_task(self.expire_session(session))
+        else:
+            await self.remove_session(session)
+        if not ws.closed:
+            # 被新连接接管
+            await ws.close()
+        return ws
+
+    async def probe_websocket_handler(
+        self, request: web.Request
+    ) -> web.WebSocketResponse:
+        """
+        网页用来比较各个地址的连接速度，不创建会话
+        """
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for _ in ws:
+            pass
+        return ws
+
+    async def hosts_handler(self, request: web.Request) -> web.Response:
+        return web.json_response({"hosts": self.hosts})
+
+    async def trace_handler(self, request: web.Request) -> web.Response:
+        """
+        导出最近的输入 trace，可以用 chrome://tracing 或 ui.perfetto.dev 打开
+        """
+        if not tracer.enabled:
+            return web.Response(status=404, text="Tracing is disabled")
+        return web.json_response(
+            tracer.chrome_trace(),
+            headers={"Content-Disposition": 'attachment; filename="trace.json"'},
+        )
+
+    async def profile_handler(self, request: web.Request) -> web.Response:
+        """
+        临时开启内存分配跟踪，?seconds=N 指定采样时长(不超过 PROFILE_SECONDS_MAX)，
+        结果同时写进日志
+        """
+        try:
+            seconds = float(request.query.get("seconds", PROFILE_SECONDS))
+        except ValueError:
+            return web.Response(status=400, text="Bad seconds")
+        # 同时排除 nan 和 inf
+        if not 0 < seconds <= PROFILE_SECONDS_MAX:
+            return web.Response(
+                status=400, text=f"seconds must be in (0, {PROFILE_SECONDS_MAX:g}]"
+            )
+        try:
+            report = await profile_memory(seconds)
+        except RuntimeError as e:
+            return web.Response(status=409, text=str(e))
+        return web.Response(text=report)
+
+    async def metrics_handler(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=self.metrics(), content_type="text/plain", charset="utf-8"
+        )
+
+    def metrics(self) -> str:
+        """
+        Prometheus 文本格式的统计数据，数值都是平时就在累加的计数器，这里只负责格式化
+        """
+        out = Exposition()
+        out.sample(
+            "vgamepadnet_sessions",
+            "gauge",
+            "Sessions holding a gamepad, including those waiting to resume",
+            len(self.clients),
+        )
+        out.sample(
+            "vgamepadnet_sessions_connected",
+            "gauge",
+            "Sessions with a live connection",
+            sum(1 for session in self.clients if not session.idle.is_set()),
+        )
+        out.sample(
+            "vgamepadnet_connects_total",
+            "counter",
+            "New sessions created",
+            self.connect_count,
+        )
+        out.sample(
+            "vgamepadnet_resumes_total",
+            "counter",
+            "Reconnects that resumed an existing session",
+            self.resume_count,
+        )
+        driver = self.driver
+        out.sample(
+            "vgamepadnet_driver_queue_depth",
+            "gauge",
+            "Jobs waiting for the driver thread",
+            driver.depth(),
+        )
+        out.sample(
+            "vgamepadnet_driver_reports_total",
+            "counter",
+            "Reports submitted to the driver thread",
+            driver.submit_count,
+        )
+        out.sample(
+            "vgamepadnet_driver_reports_coalesced_total",
+            "counter",
+            "Reports replaced by a newer one before being written",
+            driver.coalesced,
+        )
+        out.sample(
+            "vgamepadnet_driver_stalls_total",
+            "counter",
+            "Driver calls slower than the stall threshold",
+            driver.stalls,
+        )
+        help = "Time spent in each driver call"
+        out.histogram(
+            "vgamepadnet_driver_call_seconds",
+            help,
+            driver.report_latency,
+            {"kind": "report"},
+        )
+        out.histogram(
+            "vgamepadnet_driver_call_seconds",
+            help,
+            driver.call_latency,
+            {"kind": "call"},
+        )
+        # 同一个指标的所有会话要连在一起输出
+        sessions = sorted(self.clients, key=lambda session: session.session_id)
+        for name, kind, help, get in SESSION_METRICS:
+            for session in sessions:
+                out.sample(
+                    f"vgamepadnet_session_{name}",
+                    kind,
+                    help,
+                    get(session),
+                    {"session": str(session.session_id)},
+                )
+        return out.text()
+
+    async def resume_session(self, token: Optional[str]) -> Optional[Session]:
+        """
+        按 resume_token 找回断线的会话。旧连接还没发现断开时直接接管
+        """
+        if token is None or self.resume_grace <= 0:
+            return None
+        try:
+            session = self.sessions_by_token.get(int(token))
+        except ValueError:
+            return None
+        if session is None:
+            return None
+        if not session.idle.is_set():
+            session.detach()
+            await session.idle.wait()
+        if session.expire_task is None:
+            # 已经在移除了
+            return None
+        session.expire_task.cancel()
+        session.expire_task = None
+        return session
+
+    async def expire_session(self, session: Session) -> None:
+        """
+        等待重连，超时后移除会话和手柄
+        """
+        await asyncio.sleep(self.resume_grace)
+        session.expire_task = None
+        log.info("session %d: not resumed, removing", session.session_id)
+        await self.remove_session(session)
+
+    async def remove_session(self, session: Session) -> None:
+        await session.cleanup()
         for cb in self.on_disconnect:
             try:
                 await cb(self, session)
             except Exception:
                 log.error(traceback.format_exc())
         self.clients.remove(session)
-        self.session_id_used.remove(session_id_next)
-        return ws
+        self.session_id_used.remove(session.session_id)
+        del self.sessions_by_token[session.resume_token]
 
     async def run(self, host: str, port: int, path_prefix: str) -> None:
         self.app = web.Application()
         self.app.router.add_get(
             f"/{path_prefix}/websocket", self.dynamic_websocket_handler
         )
+        self.app.router.add_get(f"/{path_prefix}/probe", self.probe_websocket_handler)
+        self.app.router.add_get(f"/{path_prefix}/hosts", self.hosts_handler)
+        self.app.router.add_get(f"/{path_prefix}/metrics", self.metrics_handler)
+        self.app.router.add_get(f"/{path_prefix}/trace", self.trace_handler)
+        self.app.router.add_get(f"/{path_prefix}/profile", self.profile_handler)
         self.app.router.add_get(
             f"/{path_prefix}/", self.static_resp("index.html", "text/html")
         )
@@ -89,15 +362,26 @@ class Server:
             f"/{path_prefix}/style.css",
             self.static_resp("style.css", "text/css"),
         )
+        self.driver.start()
+        # 在后台插入，不用等待
+        self.pool.refill()
         self.runner = web.AppRunner(self.app)
         await self.runner.setup()
         self.site = web.TCPSite(self.runner, host, port)
         await self.site.start()
         await self._close_event.wait()
         for client in self.clients.copy():
-            await client.close()
+            if client.expire_task is not None:
+                client.expire_task.cancel()
+                client.expire_task = None
+                await self.remove_session(client)
+            else:
+                await client.close()
         if self.runner is not None:
             await self.runner.cleanup()
+        await self.driver.stop()
+        await self.pool.close()
+        log.info(self.pool.summary())
 
     async def close(self) -> None:
         self._close_event.set()
@@ -1,72 +1,75 @@
 import logging
 import traceback
 import asyncio
-from typing import Awaitable, Callable, Dict, Set, Optional, Union, Literal, DefaultDict
-from collections import defaultdict
-from enum import Enum
+import secrets
+import threading
+from typing import (
+    Any,
+    Coroutine,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Set,
+    Optional,
+    Tuple,
+)
 
-from aiohttp import web, WSMsgType, WSCloseCode
-import vgamepad  # type: ignore
+from aiohttp import web, WSMessage, WSMsgType, WSCloseCode
+
+from . import protocol
+from .backend import Gamepad, GamepadMode
+from .driver import Driver
+from .pool import GamepadPool
+from .state import FieldState
+from .trace import tracer
+from . import trace
 
 log = logging.getLogger(__name__)
 
 
-button_map_xbox: Dict[str, vgamepad.XUSB_BUTTON] = {
-    "up": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_UP,
-    "down": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_DOWN,
-    "left": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_LEFT,
-    "right": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_RIGHT,
-    "start": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_START,
-    "back": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_BACK,
-    "LS": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_LEFT_THUMB,
-    "RS": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_RIGHT_THUMB,
-    "LB": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_LEFT_SHOULDER,
-    "RB": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_RIGHT_SHOULDER,
-    "guide": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_GUIDE,
-    "A": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_A,
-    "B": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_B,
-    "X": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_X,
-    "Y": vgamepad.XUSB_BUTTON.XUSB_GAMEPAD_Y,
-}
-
-
-button_map_ds4: Dict[
-    str, Union[vgamepad.DS4_BUTTONS, vgamepad.DS4_SPECIAL_BUTTONS, Literal["DPAD"]]
-] = {
-    "up": "DPAD",
-    "down": "DPAD",
-    "left": "DPAD",
-    "right": "DPAD",
-    "start": vgamepad.DS4_BUTTONS.DS4_BUTTON_OPTIONS,
-    "back": vgamepad.DS4_BUTTONS.DS4_BUTTON_SHARE,
-    "LS": vgamepad.DS4_BUTTONS.DS4_BUTTON_THUMB_LEFT,
-    "RS": vgamepad.DS4_BUTTONS.DS4_BUTTON_THUMB_RIGHT,
-    "LB": vgamepad.DS4_BUTTONS.DS4_BUTTON_SHOULDER_LEFT,
-    "RB": vgamepad.DS4_BUTTONS.DS4_BUTTON_SHOULDER_RIGHT,
-    "guide": vgamepad.DS4_SPECIAL_BUTTONS.DS4_SPECIAL_BUTTON_PS,
-    "A": vgamepad.DS4_BUTTONS.DS4_BUTTON_CROSS,
-    "B": vgamepad.DS4_BUTTONS.DS4_BUTTON_CIRCLE,
-    "X": vgamepad.DS4_BUTTONS.DS4_BUTTON_SQUARE,
-    "Y": vgamepad.DS4_BUTTONS.DS4_BUTTON_TRIANGLE,
-}
-
-direction_map_ds4 = {
-    (0, -1): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_NORTH,
-    (1, -1): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_NORTHEAST,
-    (1, 0): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_EAST,
-    (1, 1): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_SOUTHEAST,
-    (0, 1): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_SOUTH,
-    (-1, 1): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_SOUTHWEST,
-    (-1, 0): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_WEST,
-    (-1, -1): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_NORTHWEST,
-    (0, 0): vgamepad.DS4_DPAD_DIRECTIONS.DS4_BUTTON_DPAD_NONE,
-}
-
-
-class GamepadMode(Enum):
-    NONE = 0
-    XBOX = 1
-    DS4 = 2
+button_fields = set(protocol.BUTTON_FIELDS)
+field_id = protocol.FIELD_ID
+stick_lx, stick_ly, stick_rx, stick_ry = (
+    field_id[name] for name in protocol.STICK_FIELDS
+)
+
+FEEDBACK_THRESHOLD = 0.02  # 马达强度变化小于这个值时不发送给客户端
+SEQ_STALE_MS = 100  # 比最快的帧晚到这么多毫秒的帧算作过期(如网络卡顿后一起到达)
+# 两端时钟的漂移：最快一帧的时间差基准每毫秒最多上调这么多，避免基准过时后把所有帧当作过期
+SEQ_DRIFT = 0.001
+# 不知道客户端当前的反馈状态(如断线重连后)，下次一定发送
+FEEDBACK_UNKNOWN = (-1.0, -1.0, -1.0)
+CLIENT_LOG_RATE = 5.0  # 客户端 log 命令每秒平均写入日志的条数
+CLIENT_LOG_BURST = 20  # 短时间内最多连续写入的条数
+
+
+def crosses_zero(old: float, new: float) -> bool:
+    """
+    按下或松开：数值在 0 和非 0 之间变化。按键和当作按键用的扳机(LTb/RTb)都算
+    """
+    return (old == 0) != (new == 0)
+
+
+def motor_changed(old: float, new: float) -> bool:
+    """
+    马达强度的变化是否需要发送给客户端
+    """
+    if new == old:
+        return False
+    return new == 0 or old == 0 or abs(new - old) >= FEEDBACK_THRESHOLD
+
+
+class SessionSnapshot(NamedTuple):
+    """
+    某个版本的手柄数据，创建后不再修改
+    """
+
+    version: int  # 对应的 Session.version
+    gamepad_mode: GamepadMode
+    state: FieldState
+    state_out: FieldState
 
 
 class Session:
@@ -74,186 +77,754 @@ class Session:
     一个连接的会话，这里直接控制一个新的虚拟手柄
     """
 
-    def __init__(self, session_id: int, ws: web.WebSocketResponse) -> None:
+    def __init__(
+        self,
+        session_id: int,
+        ws: web.WebSocketResponse,
+        driver: Driver,
+        pool: GamepadPool,
+        report_rate: Optional[int] = None,
+        feedback_rate: Optional[float] = None,
+    ) -> None:
         self.session_id = session_id
+        # 断线重连时用来找回这个会话，48 位以内，客户端可以当作普通数字解析
+        self.resume_token = secrets.randbits(48)
         self.ws = ws
+        self.driver = driver
+        self.pool = pool
         self.disconnected = False
         self.main_loop = asyncio.get_running_loop()
-        self.gamepad: Optional[Union[vgamepad.VX360Gamepad, vgamepad.VDS4Gamepad]] = (
-            None
-        )
+        self.gamepad: Optional[Gamepad] = None
         self.gamepad_mode: GamepadMode = GamepadMode.NONE
 
-        self.state: DefaultDict[str, Union[int, float]] = defaultdict(int)
-        self.state_out: DefaultDict[str, Union[int, float]] = defaultdict(int)
+        self.state = FieldState(protocol.FIELD_ID)
+        self.state_out = FieldState(protocol.OUTPUT_FIELD_ID)
+
+        # 手柄数据每次变化加一，界面等读取方比较版本号决定是否需要重新读取
+        self.version = 0
+        self.last_snapshot: Optional[SessionSnapshot] = None
+
+        self.message_count = 0  # 收到的消息数
+        self.message_bytes = 0  # 收到的消息长度之和
+        self.fields_applied = 0  # 实际修改了状态的字段数
+        self.update_count = 0  # 交给驱动线程的报告数
+        # 客户端 log 命令的令牌桶
+        self.log_tokens = float(CLIENT_LOG_BURST)
+        self.log_time = 0.0
+        self.log_dropped = 0  # 超过频率限制丢掉的日志数
+        # 启用 trace 时使用：已开始处理的消息数，还没应用的状态帧的编号，
+        # 和最新报告包含的最后一条消息的编号
+        self.trace_handled = 0
+        self.trace_frames: List[int] = []
+        self.trace_submitted = 0
+        self.update_saved = 0  # 合并字段后少发送的报告数
+        self.button_edge = False  # 上次提交报告后有字段按下或松开(见 crosses_zero)
+
+        # 以下只在驱动线程里使用
+        self.left_stick_dirty = False  # 摇杆的 X 或 Y 轴已修改，等待写入报告
+        self.right_stick_dirty = False
+        # 字段编号 -> 修改报告的函数，切换模式时生成
+        self.handlers: List[Callable[[float], None]] = []
+        self.written: Optional[List[float]] = None  # 上次写入手柄的状态
+
+        # 定时发送报告，None 表示收到数据就立即发送
+        self.report_rate = report_rate
+        self.report_task: Optional[asyncio.Task[None]] = None
+        self.pending: Dict[str, float] = {}  # 等待下一个周期发送的字段
+        self.pending_since: Optional[float] = None
+        self.pending_ready = asyncio.Event()  # pending 里有字段等待发送
+        self.pending_delay_max = 0.0  # 字段等待发送的最长时间(秒)
+        self.pending_delay_total = 0.0
+        self.pending_flush_count = 0
 
-        self.on_change: Set[Callable[[Session], Awaitable[None]]] = (
-            set()
-        )  # 手柄数据变化时调用
+        # 输入帧的序号和客户端时间
+        self.seq_last: Optional[int] = None
+        self.seq_gaps = 0  # 缺失的序号数
+        self.seq_stale = 0  # 过期(太晚到达或序号比已处理的旧)的帧数
+        self.seq_dropped = 0  # 过期帧里暂缓应用的字段数
+        self.seq_offset_min: Optional[float] = None  # 服务器与客户端时间差的最小值
+        self.seq_offset_time = 0.0  # 上次更新 seq_offset_min 的时间(毫秒)
+        # 过期帧里没有按下或松开的字段，只保留最新值；之后的帧包含同一字段时丢掉，
+        # 否则 SEQ_STALE_MS 后再应用，保证最终位置不会丢
+        self.seq_held: Dict[str, float] = {}
+        self.seq_held_timer: Optional[asyncio.TimerHandle] = None
+        self.seq_age_max = 0.0  # 帧到达时的延迟(相对于最快的一帧，毫秒)
+        self.seq_age_total = 0.0
+        self.seq_count = 0
+
+        # 收到但还没处理的消息
+        self.inbox: List[WSMessage] = []
+        self.inbox_ready = asyncio.Event()
+        self.frames_merged = 0  # 积压时合并掉的状态帧数
+        self.background_tasks: Set[asyncio.Task[None]] = set()
+
+        # 断线重连
+        self.receive_task: Optional[asyncio.Task[None]] = None
+        self.idle = asyncio.Event()  # 没有连接在运行(run 已经结束)
+        self.idle.set()
+        self.stopped_at = 0.0  # 上次连接断开的时间
+        self.expire_task: Optional[asyncio.Task[None]] = None  # 等待重连的超时
+
+        # 震动和 LED 反馈，由通知线程写入最新值，事件循环读取
+        self.feedback: Tuple[int, int, int] = (0, 0, 0)
+        self.feedback_scheduled = False  # 已经安排事件循环处理
+        self.feedback_lock = threading.Lock()
+        self.feedback_count = 0  # 收到的通知数
+        self.feedback_merged = 0  # 事件循环处理前被更新的值覆盖的通知数
+        self.feedback_unchanged = 0  # 数值和上次相同而忽略的通知数
+        # 发送给客户端的反馈，每秒最多 feedback_rate 次，None 表示不限制
+        self.feedback_rate = feedback_rate
+        self.feedback_out: Tuple[float, float, float] = (0.0, 0.0, 0.0)  # 已发送的值
+        self.feedback_out_time = 0.0
+        self.feedback_timer: Optional[asyncio.TimerHandle] = None
+        self.feedback_out_count = 0  # 发送的反馈数
+        self.feedback_small = 0  # 变化太小没有发送的次数
+        self.feedback_delayed = 0  # 因频率限制推迟发送的次数
 
     async def run(self) -> None:
-        await self.ws.send_str(f"set session_id {self.session_id}")
-        self.state_out["session_id"] = self.session_id
-        async for msg in self.ws:
-            if msg.type == WSMsgType.TEXT:
-                try:
-                    await self.handle_message(msg.data)
-                except Exception:
-                    log.error(traceback.format_exc())
-            elif msg.type == WSMsgType.ERROR:
-                log.error(f"ws connection closed with exception {self.ws.exception()}")
-                self.disconnected = True
-                break
-            elif msg.type == WSMsgType.CLOSE:
-                log.info(f"ws connection closed with code {msg.data}")
+        self.idle.clear()
+        try:
+            await self.ws.send_str(
+                f"set session_id {self.session_id} resume_token {self.resume_token}"
+            )
+            self.state_out["session_id"] = self.session_id
+            if self.feedback_out == FEEDBACK_UNKNOWN:
+                # 重连后重新发送当前的震动和 LED，断线前发送的可能没有送到
+                self.flush_feedback()
+            if self.report_rate is not None:
+                self.report_task = asyncio.create_task(self.report_loop())
+            self.receive_task = asyncio.create_task(self.receive_loop())
+            while True:
+                await self.inbox_ready.wait()
+                self.inbox_ready.clear()
+                batch = self.inbox
+                self.inbox = []
+                if batch:
+                    await self.handle_batch(batch)
+                if self.receive_task.done() and not self.inbox:
+                    break
+        finally:
+            if self.receive_task is not None:
+                self.receive_task.cancel()
+                self.receive_task = None
+            if self.report_task is not None:
+                self.report_task.cancel()
+                self.report_task = None
+            self.neutralize()
+            self.stopped_at = self.main_loop.time()
+            self.idle.set()
+
+    def neutralize(self) -> None:
+        """
+        松开所有按键，摇杆和扳机回到中间，连接断开时使用
+        """
+        self.pending.clear()
+        self.pending_since = None
+        self.seq_held.clear()
+        if self.seq_held_timer is not None:
+            self.seq_held_timer.cancel()
+            self.seq_held_timer = None
+        self.state.clear()
+        if self.gamepad is not None:
+            self.button_edge = True
+            self.submit_update()
+
+    def attach(self, ws: web.WebSocketResponse) -> None:
+        """
+        断线重连后换成新的连接，手柄和会话编号保持不变
+        """
+        self.ws = ws
+        self.disconnected = False
+        self.inbox = []
+        self.inbox_ready = asyncio.Event()
+        self.seq_last = None
+        self.seq_offset_min = None
+        self.feedback_out = FEEDBACK_UNKNOWN
+        # 旧连接没处理的消息已经丢掉，消息编号从新连接收到的开始
+        self.trace_handled = self.message_count
+        self.trace_frames.clear()
+
+    def detach(self) -> None:
+        """
+        新连接接管这个会话时，停止处理旧连接的消息
+        """
+        self.disconnected = True
+        if self.receive_task is not None:
+            self.receive_task.cancel()
+
+    async def receive_loop(self) -> None:
+        """
+        尽快把收到的消息放进 inbox，处理跟不上时消息在 inbox 里积累，由 handle_batch 合并
+        """
+        ws = self.ws
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT or msg.type == WSMsgType.BINARY:
+                    self.message_count += 1
+                    self.message_bytes += len(msg.data)
+                    if tracer.enabled:
+                        tracer.mark(trace.RECEIVE, self.session_id, self.message_count)
+                    self.inbox.append(msg)
+                    self.inbox_ready.set()
+                elif msg.type == WSMsgType.ERROR:
+                    log.error("ws connection closed with exception %s", ws.exception())
+                    self.disconnected = True
+                    break
+                elif msg.type == WSMsgType.CLOSE:
+                    log.info("ws connection closed with code %s", msg.data)
+                    self.disconnected = True
+                    break
+        except Exception:
+            log.error(traceback.format_exc())
+        finally:
+            # 正常关闭时 async for 直接结束，收不到 CLOSE 消息
+            if self.ws is ws:
                 self.disconnected = True
-                break
-        await self.cleanup()
+            self.inbox_ready.set()
+
+    async def handle_batch(self, batch: List[WSMessage]) -> None:
+        """
+        处理积累的消息，连续的状态帧合并成一次修改，只应用最终结果。
+        字段在合并范围内按下或松开(见 crosses_zero)时先应用之前的部分，
+        保证按键和扳机的短按都能被游戏看到
+        """
+        delta: Dict[str, float] = {}
+        for msg in batch:
+            if tracer.enabled:
+                self.trace_handled += 1
+                tracer.mark(trace.PARSE, self.session_id, self.trace_handled)
+            try:
+                fields = self.parse_frame(msg)
+            except Exception:
+                log.error(traceback.format_exc())
+                continue
+            if fields is None:
+                self.apply_delta(delta)
+                await self.handle_message(msg.data)
+                continue
+            if delta:
+                self.frames_merged += 1
+            for name, value in fields:
+                old = delta.get(name)
+                if old is not None and crosses_zero(old, value):
+                    self.apply_delta(delta)
+                delta[name] = value
+            if tracer.enabled and fields:
+                # 只有状态帧记录 APPLY，控制消息(ping、mode 等)不是输入
+                self.trace_frames.append(self.trace_handled)
+        self.apply_delta(delta)
+        self.notify_change()
+
+    def parse_frame(self, msg: WSMessage) -> Optional[List[Tuple[str, float]]]:
+        """
+        解析状态帧，不是状态帧时返回 None
+        """
+        if msg.type == WSMsgType.BINARY:
+            return self.parse_binary(msg.data)
+        args = msg.data.split(" ")
+        if args[0] != "set":
+            return None
+        log.debug("> %s", msg.data)
+        return self.parse_set(args)
+
+    def apply_delta(self, delta: Dict[str, float]) -> None:
+        if not delta:
+            return
+        fields = list(delta.items())
+        delta.clear()
+        try:
+            self.input_states(fields)
+        except Exception:
+            log.error(traceback.format_exc())
 
     def reply_threadsafe(self, msg: str) -> None:
         if not self.disconnected:
             coro = self.ws.send_str(msg)
             asyncio.run_coroutine_threadsafe(coro, self.main_loop)
 
-    def handle_gamepad_status(  # type: ignore
-        self, client, target, large_motor, small_motor, led_number, user_data
-    ):
+    def handle_gamepad_status(
+        self, large_motor: int, small_motor: int, led_number: int
+    ) -> None:
+        """
+        (通知线程) 只记下最新的值，还没安排时才切换到事件循环处理
+        """
+        with self.feedback_lock:
+            self.feedback_count += 1
+            self.feedback = (large_motor, small_motor, led_number)
+            if self.feedback_scheduled:
+                self.feedback_merged += 1
+                return
+            self.feedback_scheduled = True
+        self.main_loop.call_soon_threadsafe(self.apply_feedback)
+
+    def apply_feedback(self) -> None:
+        with self.feedback_lock:
+            large_motor, small_motor, led_number = self.feedback
+            self.feedback_scheduled = False
+        # 断线时也记下最新的值，重连后发送给客户端
         large_motor_v = large_motor / 255
         small_motor_v = small_motor / 255
-        for cb in self.on_change:
-            asyncio.run_coroutine_threadsafe(cb(self), self.main_loop)
-        if not self.disconnected:
-            self.state_out["large_motor"] = large_motor_v
-            self.state_out["small_motor"] = small_motor_v
-            self.state_out["led_number"] = led_number
-            log.debug(
-                f"large: {large_motor_v}, small: {small_motor_v}, led: {led_number}"
-            )
-            self.reply_threadsafe(
+        if (
+            self.state_out["large_motor"] == large_motor_v
+            and self.state_out["small_motor"] == small_motor_v
+            and self.state_out["led_number"] == led_number
+        ):
+            self.feedback_unchanged += 1
+            return
+        self.state_out["large_motor"] = large_motor_v
+        self.state_out["small_motor"] = small_motor_v
+        self.state_out["led_number"] = led_number
+        log.debug(
+            "large: %s, small: %s, led: %s", large_motor_v, small_motor_v, led_number
+        )
+        self.notify_change()
+        if self.feedback_timer is None:
+            self.flush_feedback()
+        else:
+            self.feedback_delayed += 1
+
+    def flush_feedback(self) -> None:
+        """
+        把最新的反馈发送给客户端。马达变化太小时不发送，但关闭马达和 LED 变化一定会发送；
+        距离上次发送太近时推迟到允许的时间再发送最新的值
+        """
+        self.feedback_timer = None
+        if self.disconnected:
+            return
+        large_motor, small_motor, led_number = self.feedback_out
+        large_motor_v = self.state_out["large_motor"]
+        small_motor_v = self.state_out["small_motor"]
+        led_number_v = self.state_out["led_number"]
+        if (
+            led_number_v == led_number
+            and not motor_changed(large_motor, large_motor_v)
+            and not motor_changed(small_motor, small_motor_v)
+        ):
+            self.feedback_small += 1
+            return
+        now = self.main_loop.time()
+        if self.feedback_rate is not None:
+            next_time = self.feedback_out_time + 1 / self.feedback_rate
+            if now < next_time:
+                self.feedback_delayed += 1
+                self.feedback_timer = self.main_loop.call_at(
+                    next_time, self.flush_feedback
+                )
+                return
+        self.feedback_out = (large_motor_v, small_motor_v, led_number_v)
+        self.feedback_out_time = now
+        self.feedback_out_count += 1
+        self.start_task(
+            self.ws.send_str(
                 f"set large_motor {large_motor_v}"
                 f" small_motor {small_motor_v}"
-                f" led_number {led_number}"
+                f" led_number {int(led_number_v)}"
             )
+        )
+
+    def allow_log(self) -> bool:
+        """
+        限制客户端写入日志的频率，避免刷满日志或拖慢写日志的线程
+        """
+        now = self.main_loop.time()
+        self.log_tokens = min(
+            CLIENT_LOG_BURST, self.log_tokens + (now - self.log_time) * CLIENT_LOG_RATE
+        )
+        self.log_time = now
+        if self.log_tokens < 1:
+            self.log_dropped += 1
+            return False
+        self.log_tokens -= 1
+        return True
+
+    def start_task(self, coro: Coroutine[Any, Any, None]) -> None:
+        """
+        在后台运行，保留引用直到完成
+        """
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.task_done)
+
+    def task_done(self, task: "asyncio.Task[None]") -> None:
+        self.background_tasks.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            # 多半是连接已经断开，重连后会重新发送
+            log.warning("session %d: background task failed: %r", self.session_id, exc)
 
     async def handle_message(self, cmd: str) -> None:
-        log.debug(f"> {cmd}")
+        """
+        处理状态帧以外的命令，set 帧都由 handle_batch 解析和合并
+        """
+        log.debug("> %s", cmd)
         args = cmd.split(" ")
         try:
-            if args[0] == "set":
-                i = 1
-                while i + 1 < len(args):
-                    name = args[i]
-                    value = float(args[i + 1])
-                    self.set_state(name, value)
-                    i += 2
-            elif args[0] == "reset":
+            if args[0] == "reset":
+                self.pending.clear()
+                self.pending_since = None
                 self.state.clear()
                 if self.gamepad is not None:
-                    self.gamepad.reset()
-                    self.gamepad.update()
+                    await self.driver.call(self, self.reset_gamepad)
+                    self.submit_update()
                 else:
                     log.warning("reset: gamepad not ready")
             elif args[0] == "mode":
                 if args[1] == "xbox":
-                    if self.gamepad is not None:
-                        self.gamepad.unregister_notification()
-                    self.gamepad = vgamepad.VX360Gamepad()
-                    self.gamepad.register_notification(self.handle_gamepad_status)
-                    self.gamepad_mode = GamepadMode.XBOX
-                    self.state.clear()
+                    mode = GamepadMode.XBOX
                 elif args[1] == "ds4":
-                    if self.gamepad is not None:
-                        self.gamepad.unregister_notification()
-                    self.gamepad = vgamepad.VDS4Gamepad()
-                    self.gamepad.register_notification(self.handle_gamepad_status)
-                    self.gamepad_mode = GamepadMode.DS4
-                    self.state.clear()
+                    mode = GamepadMode.DS4
                 else:
                     raise ValueError(f"Wrong mode {args[1]!r}")
+                # 旧模式下还没发送的字段不能写进新的手柄
+                self.pending.clear()
+                self.pending_since = None
+                self.state.clear()
+                # 模式没变时(如重连后)继续使用原来的手柄
+                if self.gamepad is None or mode != self.gamepad_mode:
+                    # 插入设备可能很慢，在手柄池的线程里进行，不影响其他手柄的报告
+                    gamepad = await self.pool.acquire(mode)
+                    await self.driver.call(
+                        self, lambda: self.set_gamepad(gamepad, mode)
+                    )
                 # trigger value change
-                for name, value in self.state.items():
-                    self.set_state(name, value, force=True)
+                self.submit_update()
             elif args[0] == "update":
                 if self.gamepad is not None:
-                    self.gamepad.update()
+                    self.submit_update()
                 else:
                     log.warning("update: gamepad not ready")
             elif args[0] == "log":
-                log.info(cmd[len(args[0]) + 1 :])
+                if self.allow_log():
+                    log.info("client %d: %s", self.session_id, cmd[len(args[0]) + 1 :])
             elif args[0] == "ping":
                 self.reply_threadsafe("pong")
             else:
                 raise ValueError(f"Unknown command {args[0]!r}")
-            for cb in self.on_change:
-                try:
-                    await cb(self)
-                except Exception:
-                    log.error(traceback.format_exc())
+            self.notify_change()
         except Exception:
             log.error(traceback.format_exc())
 
-    def set_state(self, name: str, value: float, /, force: bool = False) -> None:
-        if self.state[name] == value and not force:
-            return
-        self.state[name] = value
-        if isinstance(self.gamepad, vgamepad.VX360Gamepad):
-            button = button_map_xbox.get(name)
-            if button is not None:
-                if value == 0:
-                    self.gamepad.release_button(button)
-                else:
-                    self.gamepad.press_button(button)
-            elif name == "LT":
-                self.gamepad.left_trigger_float(value)
-            elif name == "RT":
-                self.gamepad.right_trigger_float(value)
-            elif name in {"LSx", "LSy"}:
-                self.gamepad.left_joystick_float(self.state["LSx"], self.state["LSy"])
-            elif name in {"RSx", "RSy"}:
-                self.gamepad.right_joystick_float(self.state["RSx"], self.state["RSy"])
+    def parse_set(self, args: List[str]) -> List[Tuple[str, float]]:
+        """
+        解析 set 命令，返回要修改的字段
+        """
+        fields = [(args[i], float(args[i + 1])) for i in range(1, len(args) - 1, 2)]
+        # 可选的头部: set seq 序号 time 客户端毫秒 名字 数值 ...
+        if len(fields) >= 2 and fields[0][0] == "seq" and fields[1][0] == "time":
+            fields = self.check_sequence(int(fields[0][1]), fields[1][1], fields[2:])
+        return fields
+
+    def parse_binary(self, data: bytes) -> List[Tuple[str, float]]:
+        """
+        解析二进制帧，返回要修改的字段
+        """
+        if len(data) == 0:
+            raise ValueError("Empty binary frame")
+        if data[0] == protocol.FRAME_STATE:
+            return protocol.decode_state(data)
+        elif data[0] == protocol.FRAME_STATE_SEQ:
+            seq, time_ms, fields = protocol.decode_state_seq(data)
+            return self.check_sequence(seq, time_ms, fields)
+        else:
+            raise ValueError(f"Unknown binary frame type {data[0]!r}")
+
+    def notify_change(self) -> None:
+        self.version += 1
+
+    def snapshot(self) -> SessionSnapshot:
+        """
+        当前版本的快照，版本没变时返回同一个对象，界面线程可以直接调用
+        """
+        # 先读版本号，复制期间的修改最多让下一次多刷新一遍，不会漏掉
+        version = self.version
+        snapshot = self.last_snapshot
+        if snapshot is None or snapshot.version != version:
+            snapshot = SessionSnapshot(
+                version,
+                self.gamepad_mode,
+                self.state.snapshot(),
+                self.state_out.snapshot(),
+            )
+            self.last_snapshot = snapshot
+        return snapshot
+
+    def check_sequence(
+        self, seq: int, time_ms: float, fields: List[Tuple[str, float]]
+    ) -> List[Tuple[str, float]]:
+        """
+        记录序号和延迟。太晚到达或序号比已处理的旧的帧只立即应用按键和按下/松开的扳机，
+        其他字段暂缓(见 seq_held)，避免卡顿后一下子重放一串过时的摇杆位置
+        """
+        now_ms = self.main_loop.time() * 1000
+        offset = now_ms - time_ms
+        if self.seq_offset_min is None:
+            self.seq_offset_min = offset
+        else:
+            drift = (now_ms - self.seq_offset_time) * SEQ_DRIFT
+            self.seq_offset_min = min(offset, self.seq_offset_min + drift)
+        self.seq_offset_time = now_ms
+        age = offset - self.seq_offset_min
+        self.seq_age_max = max(self.seq_age_max, age)
+        self.seq_age_total += age
+        self.seq_count += 1
+        stale = age > SEQ_STALE_MS
+        if self.seq_last is not None:
+            diff = (seq - self.seq_last) % protocol.SEQ_MOD
+            if diff == 0 or diff >= protocol.SEQ_MOD // 2:
+                stale = True
             else:
-                log.warning(f"Unknown state {name!r}: {value!r}")
-                del self.state[name]
-            self.gamepad.update()
-        elif isinstance(self.gamepad, vgamepad.VDS4Gamepad):
-            button = button_map_ds4.get(name)
-            if button == "DPAD":
-                dpad_x = 0
-                if self.state["left"] != 0:
-                    dpad_x -= 1
-                if self.state["right"] != 0:
-                    dpad_x += 1
-                dpad_y = 0
-                if self.state["up"] != 0:
-                    dpad_y -= 1
-                if self.state["down"] != 0:
-                    dpad_y += 1
-                direction = (dpad_x, dpad_y)
-                self.gamepad.directional_pad(direction_map_ds4[direction])
-            elif isinstance(button, vgamepad.DS4_SPECIAL_BUTTONS):
-                if value == 0:
-                    self.gamepad.release_special_button(button)
-                else:
-                    self.gamepad.press_special_button(button)
-            elif isinstance(button, vgamepad.DS4_BUTTONS):
-                if value == 0:
-                    self.gamepad.release_button(button)
+                self.seq_gaps += diff - 1
+                self.seq_last = seq
+        else:
+            self.seq_last = seq
+        held = self.seq_held
+        if stale:
+            self.seq_stale += 1
+            kept: List[Tuple[str, float]] = []
+            for name, value in fields:
+                old = held.get(name)
+                if old is None:
+                    old = self.state.get(name, value)
+                if name in button_fields or crosses_zero(old, value):
+                    held.pop(name, None)
+                    kept.append((name, value))
                 else:
-                    self.gamepad.press_button(button)
-            elif name == "LT":
-                self.gamepad.left_trigger_float(value)
-            elif name == "RT":
-                self.gamepad.right_trigger_float(value)
-            elif name in {"LSx", "LSy"}:
-                self.gamepad.left_joystick_float(self.state["LSx"], -self.state["LSy"])
-            elif name in {"RSx", "RSy"}:
-                self.gamepad.right_joystick_float(self.state["RSx"], -self.state["RSy"])
-            else:
-                log.warning(f"Unknown state {name!r}: {value!r}")
-                del self.state[name]
-            self.gamepad.update()
+                    held[name] = value
+                    self.seq_dropped += 1
+            if held and self.seq_held_timer is None:
+                self.seq_held_timer = self.main_loop.call_later(
+                    SEQ_STALE_MS / 1000, self.flush_held
+                )
+            return kept
+        if held:
+            for name, _ in fields:
+                held.pop(name, None)
+        return fields
+
+    def flush_held(self) -> None:
+        """
+        应用暂缓的字段中没有被之后的帧更新的部分
+        """
+        self.seq_held_timer = None
+        if not self.seq_held:
+            return
+        fields = list(self.seq_held.items())
+        self.seq_held.clear()
+        try:
+            self.input_states(fields)
+        except Exception:
+            log.error(traceback.format_exc())
+        self.notify_change()
+
+    def input_states(self, fields: Iterable[Tuple[str, float]]) -> None:
+        """
+        处理客户端发来的字段。启用定时发送时，摇杆和扳机只记录最新值，
+        等下一个周期统一发送；有字段按下或松开(见 crosses_zero)时立即连同已记录的值一起发送
+        """
+        if self.report_rate is None:
+            self.set_states(fields)
+            return
+        edge = False
+        pending = self.pending
+        for name, value in fields:
+            old = pending.get(name)
+            if old is None:
+                old = self.state.get(name, value)
+            if crosses_zero(old, value):
+                edge = True
+            pending[name] = value
+        if edge:
+            self.flush_pending()
+        elif pending and self.pending_since is None:
+            self.pending_since = self.main_loop.time()
+            self.pending_ready.set()
+
+    def flush_pending(self) -> None:
+        if not self.pending:
+            return
+        if self.pending_since is not None:
+            delay = self.main_loop.time() - self.pending_since
+            self.pending_delay_max = max(self.pending_delay_max, delay)
+            self.pending_delay_total += delay
+            self.pending_flush_count += 1
+            self.pending_since = None
+        fields = list(self.pending.items())
+        self.pending.clear()
+        self.set_states(fields)
+
+    async def report_loop(self) -> None:
+        """
+        发送记录下来的字段，两次发送之间至少间隔 1 / report_rate 秒。
+        没有等待发送的字段时不唤醒，空闲一段时间后的第一个输入立即发送
+        """
+        assert self.report_rate is not None
+        interval = 1 / self.report_rate
+        last_flush = self.main_loop.time() - interval
+        while True:
+            await self.pending_ready.wait()
+            delay = last_flush + interval - self.main_loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.pending_ready.clear()
+            if not self.pending:
+                # 已经因为按键变化立即发送了
+                continue
+            last_flush = self.main_loop.time()
+            try:
+                self.flush_pending()
+            except Exception:
+                log.error(traceback.format_exc())
+
+    def set_states(
+        self, fields: Iterable[Tuple[str, float]], /, force: bool = False
+    ) -> None:
+        """
+        先修改所有字段，最后只发送一次报告，避免游戏读到只改了一半的状态
+        """
+        changed = 0
+        for name, value in fields:
+            if self.apply_state(name, value, force=force):
+                changed += 1
+        if tracer.enabled and self.trace_frames:
+            # 合并的帧和等待定时发送的帧都在这时生效，每一条都要记录
+            for input_id in self.trace_frames:
+                tracer.mark(trace.APPLY, self.session_id, input_id)
+            if changed > 0:
+                self.trace_submitted = self.trace_frames[-1]
+            self.trace_frames.clear()
+        if changed == 0:
+            return
+        self.fields_applied += changed
+        if self.gamepad is None:
+            log.warning("gamepad not ready")
+            return
+        self.submit_update()
+        self.update_saved += changed - 1
+
+    def submit_update(self) -> None:
+        """
+        把当前状态的快照交给驱动线程发送。驱动跟不上时只发送最新的一份，
+        有字段按下或松开(包括扳机)的快照不会被覆盖
+        """
+        keep = self.button_edge
+        self.button_edge = False
+        self.driver.submit(self, self.write_report, self.state.values[:], keep)
+        self.update_count += 1
+
+    def write_report(self, values: List[float]) -> None:
+        """
+        (驱动线程) 把状态快照里变化的字段写入报告并发送给驱动
+        """
+        gamepad = self.gamepad
+        if gamepad is None:
+            return
+        written = self.written
+        if written is None:
+            for handler, value in zip(self.handlers, values):
+                handler(value)
         else:
-            log.warning(f"gamepad not ready")
+            for handler, old, value in zip(self.handlers, written, values):
+                if old != value:
+                    handler(value)
+        self.written = values
+        self.apply_sticks(values)
+        gamepad.update()
+        if tracer.enabled:
+            # 驱动只发送最新的报告，算作最后提交的那条消息
+            tracer.mark(trace.UPDATE, self.session_id, self.trace_submitted)
+
+    def apply_sticks(self, values: List[float]) -> None:
+        """
+        (驱动线程) X 和 Y 轴都修改完后再一起写入报告，避免出现只改了一个轴的中间状态
+        """
+        if self.gamepad is None:
+            return
+        if self.left_stick_dirty:
+            self.gamepad.left_stick(values[stick_lx], values[stick_ly])
+            self.left_stick_dirty = False
+        if self.right_stick_dirty:
+            self.gamepad.right_stick(values[stick_rx], values[stick_ry])
+            self.right_stick_dirty = False
+
+    def set_gamepad(
+        self,
+        gamepad: Gamepad,
+        mode: GamepadMode,
+    ) -> None:
+        """
+        (驱动线程) 换成新的虚拟手柄，旧的还给手柄池
+        """
+        if self.gamepad is not None:
+            self.pool.release(self.gamepad, self.gamepad_mode)
+        self.gamepad = gamepad
+        self.gamepad.register_notification(self.handle_gamepad_status)
+        self.gamepad_mode = mode
+        self.build_handlers()
+
+    def reset_gamepad(self) -> None:
+        """
+        (驱动线程) 清空报告
+        """
+        assert self.gamepad is not None
+        self.gamepad.reset()
+        self.build_handlers()
+
+    def close_gamepad(self) -> None:
+        """
+        (驱动线程) 清空报告并把虚拟手柄还给手柄池
+        """
+        if self.gamepad is None:
+            return
+        self.pool.release(self.gamepad, self.gamepad_mode)
+        self.gamepad = None
+
+    def build_handlers(self) -> None:
+        """
+        (驱动线程) 根据手柄类型生成字段的处理函数，热路径上只需要查一次表
+        """
+        self.handlers = []
+        self.written = None
+        self.left_stick_dirty = False
+        self.right_stick_dirty = False
+        gamepad = self.gamepad
+        if gamepad is None:
+            return
+
+        def left_stick_handler(value: float) -> None:
+            self.left_stick_dirty = True
+
+        def right_stick_handler(value: float) -> None:
+            self.right_stick_dirty = True
+
+        handlers: Dict[str, Callable[[float], None]] = {
+            name: gamepad.button_handler(name) for name in protocol.BUTTON_FIELDS
+        }
+        handlers["LT"] = gamepad.left_trigger
+        handlers["RT"] = gamepad.right_trigger
+        handlers["LSx"] = left_stick_handler
+        handlers["LSy"] = left_stick_handler
+        handlers["RSx"] = right_stick_handler
+        handlers["RSy"] = right_stick_handler
+        self.handlers = [handlers[name] for name in protocol.FIELDS]
+
+    def apply_state(self, name: str, value: float, /, force: bool = False) -> bool:
+        """
+        只修改状态，不发送。返回是否需要发送报告
+        """
+        index = field_id.get(name)
+        if index is None:
+            log.warning("Unknown state %r: %r", name, value)
+            return False
+        values = self.state.values
+        old = values[index]
+        if old == value and not force:
+            return False
+        values[index] = value
+        if crosses_zero(old, value):
+            self.button_edge = True
+        return True
 
     async def close(self) -> None:
         """
@@ -266,8 +837,50 @@ class Session:
         """
         移除虚拟手柄
         """
+        log.info(
+            "session %d: %d updates, %d saved by batching, %d frames merged",
+            self.session_id,
+            self.update_count,
+            self.update_saved,
+            self.frames_merged,
+        )
+        if self.log_dropped > 0:
+            log.info(
+                "session %d: %d client logs dropped", self.session_id, self.log_dropped
+            )
+        if self.feedback_count > 0:
+            log.info(
+                "session %d: %d feedback notifications, %d merged, %d unchanged,"
+                " %d sent, %d too small, %d rate limited",
+                self.session_id,
+                self.feedback_count,
+                self.feedback_merged,
+                self.feedback_unchanged,
+                self.feedback_out_count,
+                self.feedback_small,
+                self.feedback_delayed,
+            )
+        if self.feedback_timer is not None:
+            self.feedback_timer.cancel()
+            self.feedback_timer = None
+        if self.seq_count > 0:
+            log.info(
+                "session %d: %d sequenced frames, %d gaps, %d stale,"
+                " %d fields held back, age avg %.2fms max %.2fms",
+                self.session_id,
+                self.seq_count,
+                self.seq_gaps,
+                self.seq_stale,
+                self.seq_dropped,
+                self.seq_age_total / self.seq_count,
+                self.seq_age_max,
+            )
+        if self.pending_flush_count > 0:
+            log.info(
+                "session %d: report delay avg %.2fms max %.2fms",
+                self.session_id,
+                self.pending_delay_total / self.pending_flush_count * 1000,
+                self.pending_delay_max * 1000,
+            )
         if self.gamepad is not None:
-            self.gamepad.unregister_notification()
-            self.gamepad.reset()
-            self.gamepad.update()
-            self.gamepad = None
+            await self.driver.call(self, self.close_gamepad)
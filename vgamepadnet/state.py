@@ -0,0 +1,41 @@
+from typing import Dict, List, Optional, Tuple
+
+
+class FieldState:
+    """
+    固定布局的字段状态，数值按字段编号存在定长列表里，复制时只需要复制一小块内存
+    """
+
+    __slots__ = ("ids", "values")
+
+    def __init__(
+        self, ids: Dict[str, int], values: Optional[List[float]] = None
+    ) -> None:
+        self.ids = ids  # 字段名 -> 下标，见 protocol.FIELD_ID
+        # 用定长 list 而不是 array，读取时不需要每次新建 float 对象
+        self.values = [0.0] * len(ids) if values is None else values
+
+    def __getitem__(self, name: str) -> float:
+        return self.values[self.ids[name]]
+
+    def __setitem__(self, name: str, value: float) -> None:
+        self.values[self.ids[name]] = value
+
+    def get(self, name: str, default: float = 0.0) -> float:
+        index = self.ids.get(name)
+        if index is None:
+            return default
+        return self.values[index]
+
+    def items(self) -> List[Tuple[str, float]]:
+        values = self.values
+        return [(name, values[index]) for name, index in self.ids.items()]
+
+    def clear(self) -> None:
+        self.values[:] = [0.0] * len(self.values)
+
+    def snapshot(self) -> "FieldState":
+        """
+        复制当前数值，布局(ids)共用
+        """
+        return FieldState(self.ids, self.values[:])
@@ -0,0 +1,90 @@
+import itertools
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 一次输入经过的阶段
+RECEIVE = 0  # 收到 WebSocket 帧
+PARSE = 1  # 开始解析
+APPLY = 2  # 修改状态，报告交给驱动线程
+UPDATE = 3  # 驱动的 update() 返回
+# 相邻两个阶段之间的耗时在 trace 里显示的名字
+SLICE_NAMES = ("inbox", "parse", "driver")
+
+Event = Tuple[int, int, int, int]  # 时间(ns), 阶段, 会话编号, 输入编号
+
+
+class Tracer:
+    """
+    记录每个输入经过各个阶段的时间，保存在定长的环形缓冲区里，可以导出为
+    Chrome/Perfetto 能打开的 trace。没有启用时调用方只需要检查一次 enabled
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.events: List[Optional[Event]] = []
+        self.counter: Iterator[int] = itertools.count()
+
+    def enable(self, size: int) -> None:
+        """
+        启用并分配可以保存 size 个事件的缓冲区，应该在会话开始前调用
+        """
+        self.events = [None] * size
+        self.counter = itertools.count()
+        self.enabled = size > 0
+
+    def mark(self, stage: int, session_id: int, input_id: int) -> None:
+        """
+        记录一个事件，可以在任何线程里调用
+        """
+        # next() 在 CPython 里是原子的，不同线程不会写到同一格
+        index = next(self.counter) % len(self.events)
+        self.events[index] = (time.perf_counter_ns(), stage, session_id, input_id)
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """
+        转换成 Chrome trace 格式，每个会话一行，同一个输入相邻阶段之间画成一段
+        """
+        inputs: Dict[Tuple[int, int], Dict[int, int]] = {}
+        for event in self.events:
+            if event is None:
+                continue
+            ts, stage, session_id, input_id = event
+            stages = inputs.setdefault((session_id, input_id), {})
+            # 一个输入的多份报告只保留第一次到达每个阶段的时间
+            if stage not in stages or ts < stages[stage]:
+                stages[stage] = ts
+        pid = os.getpid()
+        trace: List[Dict[str, Any]] = []
+        for (session_id, input_id), stages in sorted(inputs.items()):
+            for stage in range(len(SLICE_NAMES)):
+                start = stages.get(stage)
+                end = stages.get(stage + 1)
+                if start is None or end is None or end < start:
+                    continue
+                trace.append(
+                    {
+                        "name": SLICE_NAMES[stage],
+                        "cat": "input",
+                        "ph": "X",
+                        "ts": start / 1000,
+                        "dur": (end - start) / 1000,
+                        "pid": pid,
+                        "tid": session_id,
+                        "args": {"input": input_id},
+                    }
+                )
+        for session_id in sorted({session_id for session_id, _ in inputs}):
+            trace.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": session_id,
+                    "args": {"name": f"session {session_id}"},
+                }
+            )
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+
+tracer = Tracer()
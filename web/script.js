@@ -117,6 +117,60 @@ var defaultPosTable = {
     // settings: { x: 100, y: 0, scale: 20, show: true },
     edit: { x: 65.33902033972704, y: 100, scale: 20, show: true },
 };
+// 二进制帧的字段编号，必须和 vgamepadnet/protocol.py 保持一致
+var BUTTON_FIELDS = [
+    "up",
+    "down",
+    "left",
+    "right",
+    "start",
+    "back",
+    "LS",
+    "RS",
+    "LB",
+    "RB",
+    "guide",
+    "A",
+    "B",
+    "X",
+    "Y",
+];
+var FRAME_STATE_SEQ = 2;
+var STATE_SEQ_FRAME_SIZE = 21; // <BIIHBBhhhh
+var TRIGGER_MAX = 255;
+var STICK_MAX = 32767;
+function encodeAxis(value, min, max) {
+    var v = Math.round((value !== null && value !== void 0 ? value : 0) * max);
+    if (v < min) {
+        v = min;
+    }
+    if (v > max) {
+        v = max;
+    }
+    return v;
+}
+function encodeState(state, seq, time) {
+    var _a;
+    var buffer = new ArrayBuffer(STATE_SEQ_FRAME_SIZE);
+    var view = new DataView(buffer);
+    var buttons = 0;
+    for (var i = 0; i < BUTTON_FIELDS.length; i++) {
+        if (((_a = state[BUTTON_FIELDS[i]]) !== null && _a !== void 0 ? _a : 0) != 0) {
+            buttons |= 1 << i;
+        }
+    }
+    view.setUint8(0, FRAME_STATE_SEQ);
+    view.setUint32(1, seq, true);
+    view.setUint32(5, time >>> 0, true);
+    view.setUint16(9, buttons, true);
+    view.setUint8(11, encodeAxis(state.LT, 0, TRIGGER_MAX));
+    view.setUint8(12, encodeAxis(state.RT, 0, TRIGGER_MAX));
+    view.setInt16(13, encodeAxis(state.LSx, -STICK_MAX, STICK_MAX), true);
+    view.setInt16(15, encodeAxis(state.LSy, -STICK_MAX, STICK_MAX), true);
+    view.setInt16(17, encodeAxis(state.RSx, -STICK_MAX, STICK_MAX), true);
+    view.setInt16(19, encodeAxis(state.RSy, -STICK_MAX, STICK_MAX), true);
+    return buffer;
+}
 var Vibration = /** @class */ (function () {
     function Vibration() {
         this.oldViberatePower = 0;
@@ -294,68 +348,96 @@ function defaultMode(def, symbol) {
             throw new Error("Unable to derive mode for ".concat(symbol));
     }
 }
-function addTouchListeners(button, touchCallback) {
-    // mouse
-    function onMouseMove(ev) {
-        touchCallback(true, ev.clientX, ev.clientY);
-        ev.stopPropagation();
-        ev.preventDefault();
-    }
-    function onMouseUp(ev) {
-        touchCallback(false, ev.clientX, ev.clientY);
-        window.removeEventListener("mousemove", onMouseMove);
-        window.removeEventListener("mouseup", onMouseUp);
-        ev.stopPropagation();
-        ev.preventDefault();
-    }
-    function onMouseDown(ev) {
-        touchCallback(true, ev.clientX, ev.clientY);
-        window.addEventListener("mousemove", onMouseMove);
-        window.addEventListener("mouseup", onMouseUp);
-        ev.stopPropagation();
-        ev.preventDefault();
+function addTouchListeners(button, touchCallback, predict) {
+    if (predict === void 0) { predict = false; }
+    // 按住这个按钮的所有触点，多个触点时取平均位置
+    var pointers = {};
+    // pointerrawupdate 不等待画面刷新就触发，支持时优先使用
+    var moveEvent = "onpointerrawupdate" in window ? "pointerrawupdate" : "pointermove";
+    function latestPosition(ev) {
+        var _a, _b, _c, _d;
+        if (predict) {
+            var predicted = (_b = (_a = ev.getPredictedEvents) === null || _a === void 0 ? void 0 : _a.call(ev)) !== null && _b !== void 0 ? _b : [];
+            if (predicted.length > 0) {
+                return predicted[predicted.length - 1];
+            }
+        }
+        var coalesced = (_d = (_c = ev.getCoalescedEvents) === null || _c === void 0 ? void 0 : _c.call(ev)) !== null && _d !== void 0 ? _d : [];
+        if (coalesced.length > 0) {
+            return coalesced[coalesced.length - 1];
+        }
+        return ev;
     }
-    button.addEventListener("mousedown", onMouseDown);
-    // Touch
-    function onTouchChange(ev) {
-        if (ev.targetTouches.length === 0) {
+    function report() {
+        var ids = Object.keys(pointers);
+        if (ids.length === 0) {
             button.classList.remove("button-touchdown");
             touchCallback(false, 0, 0);
         }
         else {
             button.classList.add("button-touchdown");
-            var x = 0, y = 0, n = ev.targetTouches.length;
-            for (var i = 0; i < n; i++) {
-                var touch = ev.targetTouches.item(i);
-                if (touch !== null) {
-                    x += touch.clientX;
-                    y += touch.clientY;
-                }
+            var x = 0, y = 0;
+            for (var _i = 0, ids_1 = ids; _i < ids_1.length; _i++) {
+                var id = ids_1[_i];
+                x += pointers[Number(id)].x;
+                y += pointers[Number(id)].y;
             }
-            touchCallback(true, x / n, y / n);
+            touchCallback(true, x / ids.length, y / ids.length);
         }
+    }
+    function onPointerDown(ev) {
+        button.setPointerCapture(ev.pointerId);
+        pointers[ev.pointerId] = { x: ev.clientX, y: ev.clientY };
+        report();
         ev.stopPropagation();
         ev.preventDefault();
     }
-    button.addEventListener("touchstart", onTouchChange);
-    button.addEventListener("touchmove", onTouchChange);
-    button.addEventListener("touchend", onTouchChange);
-    button.addEventListener("touchcancel", onTouchChange);
+    function onPointerMove(ev) {
+        if (!(ev.pointerId in pointers)) {
+            return;
+        }
+        var pos = latestPosition(ev);
+        pointers[ev.pointerId] = { x: pos.clientX, y: pos.clientY };
+        report();
+        ev.stopPropagation();
+        ev.preventDefault();
+    }
+    function onPointerUp(ev) {
+        if (!(ev.pointerId in pointers)) {
+            return;
+        }
+        delete pointers[ev.pointerId];
+        report();
+        ev.stopPropagation();
+        ev.preventDefault();
+    }
+    button.addEventListener("pointerdown", onPointerDown);
+    button.addEventListener(moveEvent, onPointerMove);
+    button.addEventListener("pointerup", onPointerUp);
+    button.addEventListener("pointercancel", onPointerUp);
+    button.addEventListener("lostpointercapture", onPointerUp);
     // revert
     function removeTouchListeners() {
-        button.removeEventListener("mousedown", onMouseDown);
-        button.removeEventListener("mouseup", onMouseUp);
-        button.removeEventListener("mousemove", onMouseMove);
-        button.removeEventListener("touchstart", onTouchChange);
-        button.removeEventListener("touchmove", onTouchChange);
-        button.removeEventListener("touchend", onTouchChange);
-        button.removeEventListener("touchcancel", onTouchChange);
+        button.removeEventListener("pointerdown", onPointerDown);
+        button.removeEventListener(moveEvent, onPointerMove);
+        button.removeEventListener("pointerup", onPointerUp);
+        button.removeEventListener("pointercancel", onPointerUp);
+        button.removeEventListener("lostpointercapture", onPointerUp);
     }
     return removeTouchListeners;
 }
 var VGamepad = /** @class */ (function () {
-    function VGamepad(parent, serverLink) {
-        this.serverLink = serverLink;
+    function VGamepad(parent, serverLinks, // 候选的 websocket 地址，同时探测，使用响应最快的
+    binary, // 使用二进制帧发送状态
+    sendInterval, // 摇杆等数值的发送间隔(毫秒)，null 表示每个动画帧发送一次
+    predict) {
+        if (binary === void 0) { binary = false; }
+        if (sendInterval === void 0) { sendInterval = null; }
+        if (predict === void 0) { predict = false; }
+        this.serverLinks = serverLinks;
+        this.binary = binary;
+        this.sendInterval = sendInterval;
+        this.predict = predict;
         this.mode = "xbox";
         this.state = {};
         this.state_out = {};
@@ -363,13 +445,23 @@ var VGamepad = /** @class */ (function () {
         this.buttons = {};
         this.websocket = null;
         this.websocketOpening = false;
+        this.seq = 0; // 输入帧序号
+        this.dirty = {}; // 已修改但还没发送的数值
+        this.flushScheduled = false;
+        this.congestionLimit = 1024; // 发送缓冲超过这个字节数时暂缓发送摇杆等数值
+        this.congested = false;
+        this.superseded = 0; // 拥塞期间被新数值覆盖、没有发送出去的次数
+        this.rankedLinks = []; // 探测时响应过的地址，按响应快慢排序
+        this.linkIndex = 0; // 当前连接使用的 rankedLinks 下标
+        this.raceId = 0; // 只采用最新一轮探测的结果
+        this.probes = [];
         this.message = "";
         this.element = document.createElement("div");
         this.element.classList.add("gamepad");
         parent.appendChild(this.element);
         this.latency = new Latency(this);
         this.vibration = new Vibration();
-        this.connect();
+        this.raceLinks();
         this.latency.start();
         this.vibration.start();
     }
@@ -385,7 +477,8 @@ var VGamepad = /** @class */ (function () {
             status.textContent =
                 "" +
                     "".concat((_b = this.state_out.session_id) !== null && _b !== void 0 ? _b : 0, ": ").concat(this.mode, "\n") +
-                    "".concat(this.latency.latency === null ? "未连接" : this.latency.latency + "ms", "\n") +
+                    "".concat(this.latency.latency === null ? "未连接" : this.latency.latency + "ms") +
+                    "".concat(this.superseded > 0 ? " \u8DF3\u8FC7".concat(this.superseded) : "", "\n") +
                     "".concat(this.message);
         }
     };
@@ -407,12 +500,94 @@ var VGamepad = /** @class */ (function () {
         }
         localStorage.setItem("buttonPosTable", JSON.stringify(totalPos));
     };
-    VGamepad.prototype.setState = function (name, value) {
-        if (this.state[name] != value) {
-            if (this.websocket !== null && !this.websocketOpening) {
-                this.websocket.send("set ".concat(name, " ").concat(value));
+    VGamepad.prototype.setState = function (name, value, immediate) {
+        var _a;
+        if (immediate === void 0) { immediate = false; }
+        this.setStates((_a = {}, _a[name] = value, _a), immediate);
+    };
+    // 一次修改多个数值，合并成一帧发送(如摇杆的 X 和 Y 轴)
+    // immediate 为 true 时(按键按下/松开)立即发送，否则等到下一帧统一发送
+    VGamepad.prototype.setStates = function (values, immediate) {
+        if (immediate === void 0) { immediate = false; }
+        var changed = false;
+        for (var _i = 0, _a = Object.entries(values); _i < _a.length; _i++) {
+            var _b = _a[_i], name_1 = _b[0], value = _b[1];
+            if (this.state[name_1] != value) {
+                if (this.congested && this.dirty[name_1]) {
+                    this.superseded += 1;
+                }
+                this.state[name_1] = value;
+                this.dirty[name_1] = true;
+                changed = true;
+            }
+        }
+        if (!changed) {
+            return;
+        }
+        if (immediate) {
+            this.flush(true);
+        }
+        else {
+            this.scheduleFlush();
+        }
+    };
+    VGamepad.prototype.scheduleFlush = function () {
+        var _this = this;
+        if (this.flushScheduled) {
+            return;
+        }
+        this.flushScheduled = true;
+        var callback = function () {
+            _this.flushScheduled = false;
+            _this.flush(false);
+        };
+        if (this.sendInterval === null) {
+            requestAnimationFrame(callback);
+        }
+        else {
+            setTimeout(callback, this.sendInterval);
+        }
+    };
+    // 发送所有已修改的数值
+    // 发送缓冲积压时只保留每个数值的最新值，等缓冲清空后再发送；force 为 true 时(按键)总是发送
+    VGamepad.prototype.flush = function (force) {
+        if (!force &&
+            this.websocket !== null &&
+            this.websocket.bufferedAmount > this.congestionLimit) {
+            if (!this.congested) {
+                this.congested = true;
+                this.updateButtons();
             }
-            this.state[name] = value;
+            this.scheduleFlush();
+            return;
+        }
+        if (this.congested) {
+            this.congested = false;
+            this.updateButtons();
+        }
+        var fields = "";
+        for (var _i = 0, _a = Object.keys(this.dirty); _i < _a.length; _i++) {
+            var name_2 = _a[_i];
+            fields += " ".concat(name_2, " ").concat(this.state[name_2]);
+        }
+        this.dirty = {};
+        if (fields !== "" && this.websocket !== null && !this.websocketOpening) {
+            this.sendState(fields);
+        }
+    };
+    // 发送带序号和时间的状态帧，fields 为文本格式的 " 名字 数值 ..."
+    // 二进制模式下忽略 fields，直接发送完整状态
+    VGamepad.prototype.sendState = function (fields) {
+        if (this.websocket === null) {
+            return;
+        }
+        this.seq = (this.seq + 1) >>> 0;
+        var time = Math.round(performance.now());
+        if (this.binary) {
+            this.websocket.send(encodeState(this.state, this.seq, time));
+        }
+        else {
+            this.websocket.send("set seq ".concat(this.seq, " time ").concat(time).concat(fields));
         }
     };
     VGamepad.prototype.setMode = function (mode) {
@@ -423,9 +598,66 @@ var VGamepad = /** @class */ (function () {
         this.message = msg;
         this.updateButtons();
     };
+    // 同时向所有地址发起探测连接，最先连上的用来建立会话，其余按顺序作为备用
+    VGamepad.prototype.raceLinks = function () {
+        var _this = this;
+        var race = ++this.raceId;
+        for (var _i = 0, _a = this.probes; _i < _a.length; _i++) {
+            var probe = _a[_i];
+            probe.close();
+        }
+        this.probes = [];
+        this.rankedLinks = [];
+        this.linkIndex = 0;
+        for (var _b = 0, _c = this.serverLinks; _b < _c.length; _b++) {
+            var link = _c[_b];
+            this.probeLink(link, race);
+        }
+        // 没有任何地址响应时稍后重试
+        setTimeout(function () {
+            if (race === _this.raceId && _this.rankedLinks.length === 0) {
+                _this.raceLinks();
+            }
+        }, 1000);
+    };
+    VGamepad.prototype.probeLink = function (link, race) {
+        var _this = this;
+        var probe = new WebSocket(link.replace(/websocket$/, "probe"));
+        this.probes.push(probe);
+        probe.addEventListener("open", function () {
+            probe.close();
+            if (race !== _this.raceId) {
+                return;
+            }
+            _this.rankedLinks.push(link);
+            if (_this.rankedLinks.length === 1) {
+                _this.connect();
+            }
+        });
+    };
+    // 加入新的候选地址，参与当前这一轮探测
+    VGamepad.prototype.addServerLinks = function (links) {
+        for (var _i = 0, links_1 = links; _i < links_1.length; _i++) {
+            var link = links_1[_i];
+            if (!this.serverLinks.includes(link)) {
+                this.serverLinks.push(link);
+                this.probeLink(link, this.raceId);
+            }
+        }
+    };
     VGamepad.prototype.connect = function () {
         var _this = this;
-        this.websocket = new WebSocket(this.serverLink);
+        var link = this.rankedLinks[this.linkIndex];
+        if (link === undefined) {
+            // 备用地址都断开了，重新探测
+            setTimeout(function () {
+                _this.raceLinks();
+            }, 1000);
+            return;
+        }
+        // 带上服务器发来的 resume_token，断线重连后继续使用原来的手柄
+        var token = this.state_out.resume_token;
+        this.websocket = new WebSocket(token === undefined ? link : "".concat(link, "?resume=").concat(token));
         this.websocketOpening = true;
         this.websocket.addEventListener("open", function () {
             _this.websocketOpening = false;
@@ -444,10 +676,9 @@ var VGamepad = /** @class */ (function () {
             }
             _this.websocket = null;
             _this.websocketOpening = false;
-            // retry
-            setTimeout(function () {
-                _this.connect();
-            }, 1000);
+            // 立即换用下一个地址
+            _this.linkIndex += 1;
+            _this.connect();
         });
     };
     VGamepad.prototype.wsInit = function () {
@@ -456,12 +687,13 @@ var VGamepad = /** @class */ (function () {
             return;
         }
         this.websocket.send("mode ".concat(this.mode));
-        var init_str = "set";
+        this.dirty = {};
+        var init_str = "";
         for (var _i = 0, _a = Object.entries(this.state); _i < _a.length; _i++) {
-            var _b = _a[_i], name_1 = _b[0], value = _b[1];
-            init_str += " ".concat(name_1, " ").concat(value);
+            var _b = _a[_i], name_3 = _b[0], value = _b[1];
+            init_str += " ".concat(name_3, " ").concat(value);
         }
-        this.websocket.send(init_str);
+        this.sendState(init_str);
     };
     VGamepad.prototype.wsMessage = function (msg) {
         var _a, _b;
@@ -512,7 +744,8 @@ var VGamepadButton = /** @class */ (function () {
         this.element = document.createElement("button");
         this.element.textContent = this.def.label;
         this.element.classList.add("button", "button-".concat(this.symbol), "button-".concat(this.def.shape));
-        addTouchListeners(this.element, this.touchCallback.bind(this));
+        addTouchListeners(this.element, this.touchCallback.bind(this), this.gamepad.predict &&
+            (this.def.shape == "stick" || this.def.shape == "trigger"));
         if (this.def.shape == "stick" || this.def.shape == "trigger") {
             this.elementShade = document.createElement("div");
             this.elementShade.classList.add("buttonshade", "buttonshade-".concat(this.symbol), "buttonshade-".concat(this.def.shape));
@@ -580,6 +813,7 @@ var VGamepadButton = /** @class */ (function () {
     };
     VGamepadButton.prototype.touchCallback = function (down, clientX, clientY) {
         var _a;
+        var _b;
         if (this.gamepad.editMode) {
             this.touchCallbackEditmode(down, clientX, clientY);
             this.prevDown = down;
@@ -593,7 +827,7 @@ var VGamepadButton = /** @class */ (function () {
         }
         switch (this.mode.mode) {
             case "press":
-                this.gamepad.setState(this.mode.name, down ? 1 : 0);
+                this.gamepad.setState(this.mode.name, down ? 1 : 0, true);
                 break;
             case "trigger":
                 {
@@ -643,8 +877,10 @@ var VGamepadButton = /** @class */ (function () {
                             sy /= d;
                         }
                     }
-                    this.gamepad.setState("".concat(this.mode.name, "x"), down ? sx : 0);
-                    this.gamepad.setState("".concat(this.mode.name, "y"), down ? sy : 0);
+                    this.gamepad.setStates((_a = {},
+                        _a["".concat(this.mode.name, "x")] = down ? sx : 0,
+                        _a["".concat(this.mode.name, "y")] = down ? sy : 0,
+                        _a));
                     this.realPos.offsetX = sx * 0.5 * this.realPos.width;
                     this.realPos.offsetY = sy * -0.5 * this.realPos.height;
                     this.updateButton();
@@ -691,7 +927,7 @@ var VGamepadButton = /** @class */ (function () {
                 break;
             case "settings":
                 if (down && !this.prevDown) {
-                    prompt("copy settings", (_a = localStorage.getItem("buttonPosTable")) !== null && _a !== void 0 ? _a : "{}");
+                    prompt("copy settings", (_b = localStorage.getItem("buttonPosTable")) !== null && _b !== void 0 ? _b : "{}");
                     if (confirm("Reset settings?")) {
                         localStorage.clear();
                         window.location.reload();
@@ -763,12 +999,21 @@ var VGamepadButton = /** @class */ (function () {
     return VGamepadButton;
 }());
 function initGamepad() {
-    var _a, _b, _c, _d, _e, _f;
+    var _a, _b, _c, _d, _e, _f, _g;
     var wsprotocol = document.location.protocol === "https:" ? "wss" : "ws";
     var PATH = document.location.host + document.location.pathname;
-    var vgamepad = new VGamepad(document.body, "".concat(wsprotocol, "://").concat(PATH, "websocket"));
+    var params = new URLSearchParams(document.location.search);
+    var rate = parseFloat((_a = params.get("rate")) !== null && _a !== void 0 ? _a : "");
+    var vgamepad = new VGamepad(document.body, ["".concat(wsprotocol, "://").concat(PATH, "websocket")], params.get("proto") === "binary", rate > 0 ? 1000 / rate : null, params.get("predict") === "1");
     // @ts-ignore
     window.vgamepad = vgamepad;
+    // 电脑有多个网卡时，其他地址也参与探测
+    fetch("hosts")
+        .then(function (resp) { return resp.json(); })
+        .then(function (data) {
+        vgamepad.addServerLinks(data.hosts.map(function (host) { return "".concat(wsprotocol, "://").concat(host).concat(document.location.pathname, "websocket"); }));
+    })
+        .catch(function (e) { return console.error(e); });
     var posTableString = localStorage.getItem("buttonPosTable");
     var posTable = {};
     var defaultPos = { x: 50, y: 50, scale: 20, show: true };
@@ -781,20 +1026,20 @@ function initGamepad() {
             console.error(e);
         }
     }
-    for (var _i = 0, _g = Object.keys(buttonDefTable); _i < _g.length; _i++) {
-        var symbol = _g[_i];
+    for (var _i = 0, _h = Object.keys(buttonDefTable); _i < _h.length; _i++) {
+        var symbol = _h[_i];
         var posTableR = posTableJson === null || posTableJson === void 0 ? void 0 : posTableJson[symbol];
-        var defaultP = (_a = defaultPosTable[symbol]) !== null && _a !== void 0 ? _a : defaultPos;
+        var defaultP = (_b = defaultPosTable[symbol]) !== null && _b !== void 0 ? _b : defaultPos;
         posTable[symbol] = {
-            x: (_b = posTableR === null || posTableR === void 0 ? void 0 : posTableR.x) !== null && _b !== void 0 ? _b : defaultP.x,
-            y: (_c = posTableR === null || posTableR === void 0 ? void 0 : posTableR.y) !== null && _c !== void 0 ? _c : defaultP.y,
-            scale: (_d = posTableR === null || posTableR === void 0 ? void 0 : posTableR.scale) !== null && _d !== void 0 ? _d : defaultP.scale,
-            show: (_e = posTableR === null || posTableR === void 0 ? void 0 : posTableR.show) !== null && _e !== void 0 ? _e : defaultP.show,
+            x: (_c = posTableR === null || posTableR === void 0 ? void 0 : posTableR.x) !== null && _c !== void 0 ? _c : defaultP.x,
+            y: (_d = posTableR === null || posTableR === void 0 ? void 0 : posTableR.y) !== null && _d !== void 0 ? _d : defaultP.y,
+            scale: (_e = posTableR === null || posTableR === void 0 ? void 0 : posTableR.scale) !== null && _e !== void 0 ? _e : defaultP.scale,
+            show: (_f = posTableR === null || posTableR === void 0 ? void 0 : posTableR.show) !== null && _f !== void 0 ? _f : defaultP.show,
         };
     }
-    for (var _h = 0, _j = Object.entries(buttonDefTable); _h < _j.length; _h++) {
-        var _k = _j[_h], symbol = _k[0], def = _k[1];
-        var button = new VGamepadButton(vgamepad, symbol, def, (_f = posTable[symbol]) !== null && _f !== void 0 ? _f : defaultPos);
+    for (var _j = 0, _k = Object.entries(buttonDefTable); _j < _k.length; _j++) {
+        var _l = _k[_j], symbol = _l[0], def = _l[1];
+        var button = new VGamepadButton(vgamepad, symbol, def, (_g = posTable[symbol]) !== null && _g !== void 0 ? _g : defaultPos);
         vgamepad.buttons[symbol] = button;
     }
     window.addEventListener("resize", function () {
@@ -151,6 +151,65 @@ const defaultPosTable: ButtonPosTable = {
   edit: { x: 65.33902033972704, y: 100, scale: 20, show: true },
 };
 
+// 二进制帧的字段编号，必须和 vgamepadnet/protocol.py 保持一致
+const BUTTON_FIELDS = [
+  "up",
+  "down",
+  "left",
+  "right",
+  "start",
+  "back",
+  "LS",
+  "RS",
+  "LB",
+  "RB",
+  "guide",
+  "A",
+  "B",
+  "X",
+  "Y",
+];
+const FRAME_STATE_SEQ = 2;
+const STATE_SEQ_FRAME_SIZE = 21; // <BIIHBBhhhh
+const TRIGGER_MAX = 255;
+const STICK_MAX = 32767;
+
+function encodeAxis(value: number | undefined, min: number, max: number) {
+  let v = Math.round((value ?? 0) * max);
+  if (v < min) {
+    v = min;
+  }
+  if (v > max) {
+    v = max;
+  }
+  return v;
+}
+function encodeState(
+  state: GamepadState,
+  seq: number,
+  time: number,
+): ArrayBuffer {
+  const buffer = new ArrayBuffer(STATE_SEQ_FRAME_SIZE);
+  const view = new DataView(buffer);
+  let buttons = 0;
+  for (let i = 0; i < BUTTON_FIELDS.length; i++) {
+    if ((state[BUTTON_FIELDS[i]] ?? 0) != 0) {
+      buttons |= 1 << i;
+    }
+  }
+  view.setUint8(0, FRAME_STATE_SEQ);
+  view.setUint32(1, seq, true);
+  view.setUint32(5, time >>> 0, true);
+  view.setUint16(9, buttons, true);
+  view.setUint8(11, encodeAxis(state.LT, 0, TRIGGER_MAX));
+  view.setUint8(12, encodeAxis(state.RT, 0, TRIGGER_MAX));
+  view.setInt16(13, encodeAxis(state.LSx, -STICK_MAX, STICK_MAX), true);
+  view.setInt16(15, encodeAxis(state.LSy, -STICK_MAX, STICK_MAX), true);
+  view.setInt16(17, encodeAxis(state.RSx, -STICK_MAX, STICK_MAX), true);
+  view.setInt16(19, encodeAxis(state.RSy, -STICK_MAX, STICK_MAX), true);
+  return buffer;
+}
+
 class Vibration {
   oldViberatePower = 0;
   oldViberateCount = 0;
@@ -321,63 +380,80 @@ function defaultMode(def: ButtonDef, symbol: string): ButtonMode {
 function addTouchListeners(
   button: HTMLButtonElement,
   touchCallback: (down: boolean, clientX: number, clientY: number) => void,
+  predict = false, // 使用浏览器预测的位置，减少摇杆延迟
 ) {
-  // mouse
-  function onMouseMove(ev: MouseEvent) {
-    touchCallback(true, ev.clientX, ev.clientY);
-    ev.stopPropagation();
-    ev.preventDefault();
-  }
-  function onMouseUp(ev: MouseEvent) {
-    touchCallback(false, ev.clientX, ev.clientY);
-    window.removeEventListener("mousemove", onMouseMove);
-    window.removeEventListener("mouseup", onMouseUp);
-    ev.stopPropagation();
-    ev.preventDefault();
-  }
-  function onMouseDown(ev: MouseEvent) {
-    touchCallback(true, ev.clientX, ev.clientY);
-    window.addEventListener("mousemove", onMouseMove);
-    window.addEventListener("mouseup", onMouseUp);
-    ev.stopPropagation();
-    ev.preventDefault();
+  // 按住这个按钮的所有触点，多个触点时取平均位置
+  const pointers: Record<number, { x: number; y: number }> = {};
+  // pointerrawupdate 不等待画面刷新就触发，支持时优先使用
+  const moveEvent =
+    "onpointerrawupdate" in window ? "pointerrawupdate" : "pointermove";
+  function latestPosition(ev: PointerEvent) {
+    if (predict) {
+      const predicted = ev.getPredictedEvents?.() ?? [];
+      if (predicted.length > 0) {
+        return predicted[predicted.length - 1];
+      }
+    }
+    const coalesced = ev.getCoalescedEvents?.() ?? [];
+    if (coalesced.length > 0) {
+      return coalesced[coalesced.length - 1];
+    }
+    return ev;
   }
-  button.addEventListener("mousedown", onMouseDown);
-  // Touch
-  function onTouchChange(ev: TouchEvent) {
-    if (ev.targetTouches.length === 0) {
+  function report() {
+    const ids = Object.keys(pointers);
+    if (ids.length === 0) {
       button.classList.remove("button-touchdown");
       touchCallback(false, 0, 0);
     } else {
       button.classList.add("button-touchdown");
       let x = 0,
-        y = 0,
-        n = ev.targetTouches.length;
-      for (let i = 0; i < n; i++) {
-        const touch = ev.targetTouches.item(i);
-        if (touch !== null) {
-          x += touch.clientX;
-          y += touch.clientY;
-        }
+        y = 0;
+      for (const id of ids) {
+        x += pointers[Number(id)].x;
+        y += pointers[Number(id)].y;
       }
-      touchCallback(true, x / n, y / n);
+      touchCallback(true, x / ids.length, y / ids.length);
     }
+  }
+  function onPointerDown(ev: PointerEvent) {
+    button.setPointerCapture(ev.pointerId);
+    pointers[ev.pointerId] = { x: ev.clientX, y: ev.clientY };
+    report();
+    ev.stopPropagation();
+    ev.preventDefault();
+  }
+  function onPointerMove(ev: PointerEvent) {
+    if (!(ev.pointerId in pointers)) {
+      return;
+    }
+    const pos = latestPosition(ev);
+    pointers[ev.pointerId] = { x: pos.clientX, y: pos.clientY };
+    report();
     ev.stopPropagation();
     ev.preventDefault();
   }
-  button.addEventListener("touchstart", onTouchChange);
-  button.addEventListener("touchmove", onTouchChange);
-  button.addEventListener("touchend", onTouchChange);
-  button.addEventListener("touchcancel", onTouchChange);
+  function onPointerUp(ev: PointerEvent) {
+    if (!(ev.pointerId in pointers)) {
+      return;
+    }
+    delete pointers[ev.pointerId];
+    report();
+    ev.stopPropagation();
+    ev.preventDefault();
+  }
+  button.addEventListener("pointerdown", onPointerDown);
+  button.addEventListener(moveEvent, onPointerMove as EventListener);
+  button.addEventListener("pointerup", onPointerUp);
+  button.addEventListener("pointercancel", onPointerUp);
+  button.addEventListener("lostpointercapture", onPointerUp);
   // revert
   function removeTouchListeners() {
-    button.removeEventListener("mousedown", onMouseDown);
-    button.removeEventListener("mouseup", onMouseUp);
-    button.removeEventListener("mousemove", onMouseMove);
-    button.removeEventListener("touchstart", onTouchChange);
-    button.removeEventListener("touchmove", onTouchChange);
-    button.removeEventListener("touchend", onTouchChange);
-    button.removeEventListener("touchcancel", onTouchChange);
+    button.removeEventListener("pointerdown", onPointerDown);
+    button.removeEventListener(moveEvent, onPointerMove as EventListener);
+    button.removeEventListener("pointerup", onPointerUp);
+    button.removeEventListener("pointercancel", onPointerUp);
+    button.removeEventListener("lostpointercapture", onPointerUp);
   }
   return removeTouchListeners;
 }
@@ -392,19 +468,32 @@ class VGamepad {
   buttons: Record<string, VGamepadButton> = {};
   websocket: WebSocket | null = null;
   websocketOpening = false;
+  seq = 0; // 输入帧序号
+  dirty: Record<string, boolean> = {}; // 已修改但还没发送的数值
+  flushScheduled = false;
+  congestionLimit = 1024; // 发送缓冲超过这个字节数时暂缓发送摇杆等数值
+  congested = false;
+  superseded = 0; // 拥塞期间被新数值覆盖、没有发送出去的次数
+  rankedLinks: string[] = []; // 探测时响应过的地址，按响应快慢排序
+  linkIndex = 0; // 当前连接使用的 rankedLinks 下标
+  raceId = 0; // 只采用最新一轮探测的结果
+  probes: WebSocket[] = [];
   latency: Latency;
   vibration: Vibration;
   message = "";
   constructor(
     parent: HTMLElement,
-    public serverLink: string,
+    public serverLinks: string[], // 候选的 websocket 地址，同时探测，使用响应最快的
+    public binary: boolean = false, // 使用二进制帧发送状态
+    public sendInterval: number | null = null, // 摇杆等数值的发送间隔(毫秒)，null 表示每个动画帧发送一次
+    public predict: boolean = false, // 摇杆和扳机使用预测的触点位置
   ) {
     this.element = document.createElement("div");
     this.element.classList.add("gamepad");
     parent.appendChild(this.element);
     this.latency = new Latency(this);
     this.vibration = new Vibration();
-    this.connect();
+    this.raceLinks();
     this.latency.start();
     this.vibration.start();
   }
@@ -418,7 +507,8 @@ class VGamepad {
       status.textContent =
         `` +
         `${this.state_out.session_id ?? 0}: ${this.mode}\n` +
-        `${this.latency.latency === null ? "未连接" : this.latency.latency + "ms"}\n` +
+        `${this.latency.latency === null ? "未连接" : this.latency.latency + "ms"}` +
+        `${this.superseded > 0 ? ` 跳过${this.superseded}` : ""}\n` +
         `${this.message}`;
     }
   }
@@ -438,12 +528,87 @@ class VGamepad {
     }
     localStorage.setItem("buttonPosTable", JSON.stringify(totalPos));
   }
-  setState(name: string, value: number) {
-    if (this.state[name] != value) {
-      if (this.websocket !== null && !this.websocketOpening) {
-        this.websocket.send(`set ${name} ${value}`);
+  setState(name: string, value: number, immediate = false) {
+    this.setStates({ [name]: value }, immediate);
+  }
+  // 一次修改多个数值，合并成一帧发送(如摇杆的 X 和 Y 轴)
+  // immediate 为 true 时(按键按下/松开)立即发送，否则等到下一帧统一发送
+  setStates(values: GamepadState, immediate = false) {
+    let changed = false;
+    for (const [name, value] of Object.entries(values)) {
+      if (this.state[name] != value) {
+        if (this.congested && this.dirty[name]) {
+          this.superseded += 1;
+        }
+        this.state[name] = value;
+        this.dirty[name] = true;
+        changed = true;
+      }
+    }
+    if (!changed) {
+      return;
+    }
+    if (immediate) {
+      this.flush(true);
+    } else {
+      this.scheduleFlush();
+    }
+  }
+  scheduleFlush() {
+    if (this.flushScheduled) {
+      return;
+    }
+    this.flushScheduled = true;
+    const callback = () => {
+      this.flushScheduled = false;
+      this.flush(false);
+    };
+    if (this.sendInterval === null) {
+      requestAnimationFrame(callback);
+    } else {
+      setTimeout(callback, this.sendInterval);
+    }
+  }
+  // 发送所有已修改的数值
+  // 发送缓冲积压时只保留每个数值的最新值，等缓冲清空后再发送；force 为 true 时(按键)总是发送
+  flush(force: boolean) {
+    if (
+      !force &&
+      this.websocket !== null &&
+      this.websocket.bufferedAmount > this.congestionLimit
+    ) {
+      if (!this.congested) {
+        this.congested = true;
+        this.updateButtons();
       }
-      this.state[name] = value;
+      this.scheduleFlush();
+      return;
+    }
+    if (this.congested) {
+      this.congested = false;
+      this.updateButtons();
+    }
+    let fields = "";
+    for (const name of Object.keys(this.dirty)) {
+      fields += ` ${name} ${this.state[name]}`;
+    }
+    this.dirty = {};
+    if (fields !== "" && this.websocket !== null && !this.websocketOpening) {
+      this.sendState(fields);
+    }
+  }
+  // 发送带序号和时间的状态帧，fields 为文本格式的 " 名字 数值 ..."
+  // 二进制模式下忽略 fields，直接发送完整状态
+  sendState(fields: string) {
+    if (this.websocket === null) {
+      return;
+    }
+    this.seq = (this.seq + 1) >>> 0;
+    const time = Math.round(performance.now());
+    if (this.binary) {
+      this.websocket.send(encodeState(this.state, this.seq, time));
+    } else {
+      this.websocket.send(`set seq ${this.seq} time ${time}${fields}`);
     }
   }
   setMode(mode: GamepadMode) {
@@ -454,8 +619,62 @@ class VGamepad {
     this.message = msg;
     this.updateButtons();
   }
+  // 同时向所有地址发起探测连接，最先连上的用来建立会话，其余按顺序作为备用
+  raceLinks() {
+    const race = ++this.raceId;
+    for (const probe of this.probes) {
+      probe.close();
+    }
+    this.probes = [];
+    this.rankedLinks = [];
+    this.linkIndex = 0;
+    for (const link of this.serverLinks) {
+      this.probeLink(link, race);
+    }
+    // 没有任何地址响应时稍后重试
+    setTimeout(() => {
+      if (race === this.raceId && this.rankedLinks.length === 0) {
+        this.raceLinks();
+      }
+    }, 1000);
+  }
+  probeLink(link: string, race: number) {
+    const probe = new WebSocket(link.replace(/websocket$/, "probe"));
+    this.probes.push(probe);
+    probe.addEventListener("open", () => {
+      probe.close();
+      if (race !== this.raceId) {
+        return;
+      }
+      this.rankedLinks.push(link);
+      if (this.rankedLinks.length === 1) {
+        this.connect();
+      }
+    });
+  }
+  // 加入新的候选地址，参与当前这一轮探测
+  addServerLinks(links: string[]) {
+    for (const link of links) {
+      if (!this.serverLinks.includes(link)) {
+        this.serverLinks.push(link);
+        this.probeLink(link, this.raceId);
+      }
+    }
+  }
   connect() {
-    this.websocket = new WebSocket(this.serverLink);
+    const link = this.rankedLinks[this.linkIndex];
+    if (link === undefined) {
+      // 备用地址都断开了，重新探测
+      setTimeout(() => {
+        this.raceLinks();
+      }, 1000);
+      return;
+    }
+    // 带上服务器发来的 resume_token，断线重连后继续使用原来的手柄
+    const token = this.state_out.resume_token;
+    this.websocket = new WebSocket(
+      token === undefined ? link : `${link}?resume=${token}`,
+    );
     this.websocketOpening = true;
     this.websocket.addEventListener("open", () => {
       this.websocketOpening = false;
@@ -474,10 +693,9 @@ class VGamepad {
       }
       this.websocket = null;
       this.websocketOpening = false;
-      // retry
-      setTimeout(() => {
-        this.connect();
-      }, 1000);
+      // 立即换用下一个地址
+      this.linkIndex += 1;
+      this.connect();
     });
   }
   wsInit() {
@@ -486,11 +704,12 @@ class VGamepad {
       return;
     }
     this.websocket.send(`mode ${this.mode}`);
-    let init_str = "set";
+    this.dirty = {};
+    let init_str = "";
     for (const [name, value] of Object.entries(this.state)) {
       init_str += ` ${name} ${value}`;
     }
-    this.websocket.send(init_str);
+    this.sendState(init_str);
   }
   wsMessage(msg: string) {
     const args = msg.split(" ");
@@ -547,7 +766,12 @@ class VGamepadButton {
       `button-${this.symbol}`,
       `button-${this.def.shape}`,
     );
-    addTouchListeners(this.element, this.touchCallback.bind(this));
+    addTouchListeners(
+      this.element,
+      this.touchCallback.bind(this),
+      this.gamepad.predict &&
+        (this.def.shape == "stick" || this.def.shape == "trigger"),
+    );
     if (this.def.shape == "stick" || this.def.shape == "trigger") {
       this.elementShade = document.createElement("div");
       this.elementShade.classList.add(
@@ -627,7 +851,7 @@ class VGamepadButton {
     }
     switch (this.mode.mode) {
       case "press":
-        this.gamepad.setState(this.mode.name, down ? 1 : 0);
+        this.gamepad.setState(this.mode.name, down ? 1 : 0, true);
         break;
       case "trigger":
         {
@@ -677,8 +901,10 @@ class VGamepadButton {
               sy /= d;
             }
           }
-          this.gamepad.setState(`${this.mode.name}x`, down ? sx : 0);
-          this.gamepad.setState(`${this.mode.name}y`, down ? sy : 0);
+          this.gamepad.setStates({
+            [`${this.mode.name}x`]: down ? sx : 0,
+            [`${this.mode.name}y`]: down ? sy : 0,
+          });
           this.realPos.offsetX = sx * 0.5 * this.realPos.width;
           this.realPos.offsetY = sy * -0.5 * this.realPos.height;
           this.updateButton();
@@ -796,12 +1022,28 @@ class VGamepadButton {
 function initGamepad() {
   const wsprotocol = document.location.protocol === "https:" ? "wss" : "ws";
   const PATH = document.location.host + document.location.pathname;
+  const params = new URLSearchParams(document.location.search);
+  const rate = parseFloat(params.get("rate") ?? "");
   const vgamepad: VGamepad = new VGamepad(
     document.body,
-    `${wsprotocol}://${PATH}websocket`,
+    [`${wsprotocol}://${PATH}websocket`],
+    params.get("proto") === "binary",
+    rate > 0 ? 1000 / rate : null,
+    params.get("predict") === "1",
   );
   // @ts-ignore
   window.vgamepad = vgamepad;
+  // 电脑有多个网卡时，其他地址也参与探测
+  fetch("hosts")
+    .then((resp) => resp.json())
+    .then((data: { hosts: string[] }) => {
+      vgamepad.addServerLinks(
+        data.hosts.map(
+          (host) => `${wsprotocol}://${host}${document.location.pathname}websocket`,
+        ),
+      );
+    })
+    .catch((e) => console.error(e));
   const posTableString = localStorage.getItem("buttonPosTable");
   let posTable: ButtonPosTable = {};
   const defaultPos: ButtonPos = { x: 50, y: 50, scale: 20, show: true };